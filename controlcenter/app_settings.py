@@ -5,3 +5,15 @@ class ControlCenter(Conf):
     DASHBOARDS = []
     CHARTIST_COLORS = 'default'
     SHARP = '#'
+    CONCURRENT_WIDGETS = False
+    MAX_WORKERS = 4
+    DEFERRED_WIDGETS = False
+    CACHE_ALIAS = 'default'
+    CACHE_KEY_PREFIX = 'controlcenter'
+    PUSH_UPDATES = False
+    BROADCAST_HUB = 'controlcenter.broadcast.LocalHub'
+    STREAM_HEARTBEAT = 15
+    SERVER_TIMING = True
+    METRICS = False
+    METRICS_TOKEN = None
+    JSON_SERIALIZER = 'controlcenter.serializers.dumps'
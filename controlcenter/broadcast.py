@@ -0,0 +1,172 @@
+"""
+Broadcast hub for live dashboard updates. Every dashboard is a channel,
+events are dictionaries with widget's slug and, optionally, its data.
+"""
+
+import asyncio
+import itertools
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from . import app_settings
+
+__all__ = ['BaseHub', 'LocalHub', 'get_hub', 'publish', 'notify_changed']
+
+_hub = None
+_hub_lock = threading.Lock()
+
+
+class Subscription(object):
+    def __init__(self, hub, channel):
+        self.hub = hub
+        self.channel = channel
+        self.queue = queue.Queue()
+
+    def put(self, event):
+        self.queue.put(event)
+
+    def get(self, timeout=None):
+        # Returns None if nothing has happened in time
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+
+class AsyncSubscription(Subscription):
+    def __init__(self, hub, channel):
+        self.hub = hub
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+
+    def put(self, event):
+        # Events are published from any thread
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, event)
+
+    async def get(self, timeout=None):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class BaseHub(object):
+    def subscribe(self, channel, asynchronous=False):
+        raise NotImplementedError
+
+    def unsubscribe(self, subscription):
+        raise NotImplementedError
+
+    def publish(self, channel, event):
+        raise NotImplementedError
+
+    def once(self, key, func):
+        # Hubs that can't share the results just compute them
+        return func()
+
+
+class LocalHub(BaseHub):
+    """
+    In-memory hub, works within a single process only.
+    """
+
+    # Number of shared results to keep
+    max_results = 256
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = {}
+        self._results = OrderedDict()
+        self._ids = itertools.count(1)
+
+    def subscribe(self, channel, asynchronous=False):
+        klass = AsyncSubscription if asynchronous else Subscription
+        subscription = klass(self, channel)
+        with self._lock:
+            self._subscriptions.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.channel)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+
+    def publish(self, channel, event):
+        with self._lock:
+            event = dict(event, id=next(self._ids))
+            subscriptions = list(self._subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            subscription.put(event)
+        return event
+
+    def once(self, key, func):
+        """
+        Computes the value once for everybody who asks it with the key,
+        so N subscribers cost a single computation per event.
+        """
+        with self._lock:
+            future = self._results.get(key)
+            owner = future is None
+            if owner:
+                future = self._results[key] = Future()
+                while len(self._results) > self.max_results:
+                    self._results.popitem(last=False)
+
+        if owner:
+            try:
+                future.set_result(func())
+            except Exception as e:
+                future.set_exception(e)
+        return future.result()
+
+
+def get_hub():
+    global _hub
+    with _hub_lock:
+        if _hub is None:
+            _hub = import_string(app_settings.BROADCAST_HUB)()
+        return _hub
+
+
+@receiver(setting_changed)
+def reset_hub(setting=None, **kwargs):
+    global _hub
+    if setting is None or setting == 'CONTROLCENTER_BROADCAST_HUB':
+        _hub = None
+
+
+def publish(dashboard_pk, slug, data=None):
+    """
+    Tells dashboard viewers that the widget has changed.
+    If data is not provided viewers fetch it on their own.
+    """
+    event = {'widget': slug}
+    if data is not None:
+        event['data'] = data
+    return get_hub().publish(str(dashboard_pk), event)
+
+
+def notify_changed(widget_class):
+    # Dashboards import widgets
+    from .dashboards import get_dashboards
+
+    try:
+        dashboards = get_dashboards().values()
+    except ImproperlyConfigured:
+        return
+
+    for dashboard in dashboards:
+        if any(widget_class in x for x in dashboard.get_groups()):
+            publish(dashboard.pk, widget_class.__name__.lower())
@@ -0,0 +1,79 @@
+import hashlib
+
+from django.core.cache import caches
+
+from . import app_settings
+
+__all__ = ['get_cache', 'make_key', 'make_digest', 'get_generation',
+           'bump_generation', 'vary_on']
+
+
+def get_cache():
+    return caches[app_settings.CACHE_ALIAS]
+
+
+def make_key(*parts):
+    prefix = app_settings.CACHE_KEY_PREFIX
+    return ':'.join([prefix] + [str(x) for x in parts])
+
+
+def make_digest(*parts):
+    # Makes a short and safe key chunk of whatever is passed
+    return hashlib.md5(repr(parts).encode('utf-8')).hexdigest()
+
+
+def get_generation(name):
+    """
+    Returns current generation of the name. Generations are stored
+    in cache and are a part of cache keys, so bumping one
+    makes all the keys built with it stale at once.
+    """
+    cache = get_cache()
+    key = make_key('generation', name)
+    generation = cache.get(key)
+    if generation is None:
+        # Someone might have done it already
+        cache.add(key, 1, None)
+        generation = cache.get(key, 1)
+    return generation
+
+
+def bump_generation(name):
+    cache = get_cache()
+    key = make_key('generation', name)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Key is missing, which means the first generation is used
+        cache.set(key, 2, None)
+        return 2
+
+
+def _vary_on_user(widget):
+    user = getattr(widget.request, 'user', None)
+    return getattr(user, 'pk', None)
+
+
+def _vary_on_params(widget):
+    params = getattr(widget.request, 'GET', None)
+    return sorted(params.lists()) if params else None
+
+
+def _vary_on_dashboard(widget):
+    return getattr(widget.dashboard, 'pk', None)
+
+
+VARY_ON = {
+    'user': _vary_on_user,
+    'params': _vary_on_params,
+    'dashboard': _vary_on_dashboard,
+}
+
+
+def vary_on(widget, names):
+    """
+    Returns values to build widget's cache key with. Names are either
+    keys of ``VARY_ON`` or callables which get the widget.
+    """
+    return [VARY_ON[x](widget) if isinstance(x, str) else x(widget)
+            for x in names]
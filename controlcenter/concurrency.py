@@ -0,0 +1,232 @@
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from django.db import connections
+from django.utils.functional import cached_property
+
+from . import app_settings
+
+try:
+    from asgiref.sync import sync_to_async
+except ImportError:
+    # Django < 3.0 can't evaluate widgets asynchronously
+    sync_to_async = None
+
+__all__ = ['aevaluate_widgets', 'evaluate_widget', 'evaluate_widgets',
+           'get_cached_attrs', 'run_in_background']
+
+logger = logging.getLogger('controlcenter')
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_cached_attrs(widget):
+    # Plain methods can't be evaluated, they require arguments
+    klass = type(widget)
+    return [attr for attr in getattr(klass, 'CACHED_ATTRS', ())
+            if isinstance(getattr(klass, attr, None), cached_property)]
+
+
+def get_async_func(widget, attr):
+    # Coroutine function of the cached attribute, if it's async
+    func = getattr(type(widget), attr).func
+    return getattr(func, 'async_func', None)
+
+
+def evaluate_widget(widget, attrs=None):
+    """
+    Evaluates widget's cached attributes, all of them by default,
+    and stores the time spent on every one in ``widget.timings``.
+    """
+    if attrs is None:
+        attrs = get_cached_attrs(widget)
+    with widget.limit_statements():
+        _evaluate_attrs(widget, attrs)
+    return widget
+
+
+def _evaluate_attrs(widget, attrs):
+    for attr in attrs:
+        started = time.perf_counter()
+        try:
+            # Lazy querysets are run by the widget as well
+            getattr(widget, attr)
+        except Exception:
+            # Not cached, so the template hits it again and raises it
+            # the same way it would do without evaluation
+            logger.debug('Failed to evaluate %s.%s', widget, attr,
+                         exc_info=True)
+        finally:
+            widget.timings[attr] = time.perf_counter() - started
+
+
+def _run_in_thread(func, *args):
+    try:
+        return func(*args)
+    finally:
+        # Connections are thread-local, the pool is shut down
+        # after evaluation so they would never be closed otherwise
+        connections.close_all()
+
+
+def _run_logged(func, *args):
+    try:
+        return _run_in_thread(func, *args)
+    except Exception:
+        # Nobody waits for it, so nobody sees it otherwise
+        logger.exception('Background task %r failed', func)
+        raise
+
+
+def get_executor():
+    # The pool is shared by the process and lives as long as it does
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=app_settings.MAX_WORKERS,
+                thread_name_prefix='controlcenter')
+        return _executor
+
+
+def run_in_background(func, *args):
+    """
+    Runs the function on process-wide thread pool, returns the future.
+    """
+    return get_executor().submit(contextvars.copy_context().run,
+                                 _run_logged, func, *args)
+
+
+def evaluate_widgets(widgets, max_workers=None):
+    """
+    Evaluates widgets on a bounded thread pool. Widget's timeout
+    starts when its evaluation does, not while it's queued.
+    """
+    widgets = list(widgets)
+    if not widgets:
+        return widgets
+
+    # Same as ThreadPoolExecutor's default
+    max_workers = max_workers or min(32, (os.cpu_count() or 1) + 4)
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    changed = threading.Condition()
+    started = {}
+
+    def run(index, widget):
+        with changed:
+            started[index] = time.monotonic()
+            changed.notify_all()
+        try:
+            return _run_in_thread(evaluate_widget, widget)
+        finally:
+            with changed:
+                changed.notify_all()
+
+    try:
+        # Every task gets its own context copy to keep active language
+        # and such, a context can't be entered by two threads at once
+        futures = [executor.submit(contextvars.copy_context().run,
+                                   run, index, widget)
+                   for index, widget in enumerate(widgets)]
+        hung = 0
+        for index, (widget, future) in enumerate(zip(widgets, futures)):
+            with changed:
+                # Tasks are started in order, the ones before are either
+                # done or hung, the latter can take all the workers
+                while (index not in started and not future.done() and
+                       hung < max_workers):
+                    changed.wait()
+            if index not in started:
+                future.cancel()
+                _time_out(widget)
+                continue
+
+            timeout = widget.timeout
+            if timeout is not None:
+                timeout = max(0, started[index] + timeout - time.monotonic())
+            try:
+                future.result(timeout)
+            except FutureTimeoutError:
+                hung += 1
+                _time_out(widget)
+    finally:
+        # Hung widgets are left behind, the page doesn't wait for them
+        executor.shutdown(wait=False)
+
+    _log_timings(widgets)
+    return widgets
+
+
+async def aevaluate_widgets(widgets, max_workers=None):
+    """
+    Evaluates widgets concurrently on the running loop. Async data
+    methods are awaited on the loop, sync ones are run on threads.
+    Widget's timeout doesn't count the time it waits for a thread.
+    """
+    widgets = list(widgets)
+    if not widgets:
+        return widgets
+
+    max_workers = max_workers or min(32, (os.cpu_count() or 1) + 4)
+    semaphore = asyncio.Semaphore(max_workers)
+    evaluate = sync_to_async(_run_in_thread, thread_sensitive=False)
+    loop = asyncio.get_running_loop()
+
+    async def run(widget):
+        funcs = {attr: get_async_func(widget, attr)
+                 for attr in get_cached_attrs(widget)}
+        timeout = widget.timeout
+        started = loop.time()
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(_aevaluate_attr(widget, attr, func)
+                                 for attr, func in funcs.items() if func)),
+                timeout)
+
+            # Sync methods may use async ones, which are ready by now
+            attrs = [attr for attr, func in funcs.items() if func is None]
+            if not attrs:
+                return
+            if timeout is not None:
+                timeout = max(0, timeout - (loop.time() - started))
+            async with semaphore:
+                await asyncio.wait_for(
+                    evaluate(evaluate_widget, widget, attrs), timeout)
+        except asyncio.TimeoutError:
+            # Coroutines are cancelled, threads are just not awaited
+            _time_out(widget)
+
+    await asyncio.gather(*(run(widget) for widget in widgets))
+    _log_timings(widgets)
+    return widgets
+
+
+async def _aevaluate_attr(widget, attr, func):
+    started = time.perf_counter()
+    try:
+        # Stored the same way cached_property does it
+        widget.__dict__[attr] = await widget.aevaluate_attr(attr, func)
+    except Exception:
+        logger.debug('Failed to evaluate %s.%s', widget, attr,
+                     exc_info=True)
+    finally:
+        widget.timings[attr] = time.perf_counter() - started
+
+
+def _time_out(widget):
+    # Template renders the retry link instead of the widget
+    widget.timed_out = True
+    logger.warning('%s timed out after %ss', widget, widget.timeout)
+
+
+def _log_timings(widgets):
+    for widget in widgets:
+        logger.debug('%s evaluated in %.3fs: %s', widget,
+                     sum(widget.timings.values()), widget.timings)
@@ -1,18 +1,35 @@
+import itertools
+import threading
+from collections import OrderedDict
 from collections.abc import Sequence
 
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
 from django.forms.widgets import MediaDefiningClass
 from django.urls import reverse
+from django.utils.module_loading import import_string
 
 from . import app_settings
 from .base import BaseModel
+from .concurrency import aevaluate_widgets, evaluate_widgets
 from .widgets import Group
 
-__all__ = ['Dashboard']
+__all__ = ['Dashboard', 'load_dashboards', 'get_dashboards',
+           'reset_dashboards']
+
+# Settings the registry was built with and the registry itself
+_registry = None
+_registry_lock = threading.Lock()
 
 
 class Dashboard(BaseModel, metaclass=MediaDefiningClass):
     pk = None
     widgets = ()
+    concurrent = None
+    max_workers = None
+    deferred = None
+    push = None
 
     class Media:
         css = {
@@ -39,14 +56,107 @@ class Dashboard(BaseModel, metaclass=MediaDefiningClass):
     def get_absolute_url(self):
         return reverse('controlcenter:dashboard', kwargs={'pk': self.pk})
 
-    def get_widgets(self, request, **options):
-        # TODO: permission check
+    def get_groups(self):
         for item in self.widgets:
             if isinstance(item, Sequence):
-                group = Group() + item
+                yield Group() + item
             else:
-                group = Group([item])
+                yield Group([item])
 
-            widgets = (x(request, **options) for x in group)
+    def make_widget(self, klass, request, **options):
+        widget = klass(request, **options)
+        widget.dashboard = self
+        return widget
+
+    def get_widgets(self, request, **options):
+        # TODO: permission check
+        for group in self.get_groups():
+            widgets = (self.make_widget(x, request, **options) for x in group)
             new_group = Group(widgets, group.attrs, group.width, group.height)
             yield new_group
+
+    def get_widget(self, request, slug, **options):
+        # Only the widget requested is instantiated
+        for group in self.get_groups():
+            for klass in group:
+                if klass.__name__.lower() == slug:
+                    return self.make_widget(klass, request, **options)
+
+    def is_deferred(self):
+        if self.deferred is None:
+            return app_settings.DEFERRED_WIDGETS
+        return self.deferred
+
+    def is_push(self):
+        if self.push is None:
+            return app_settings.PUSH_UPDATES
+        return self.push
+
+    def get_stream_url(self):
+        return reverse('controlcenter:stream', kwargs={'pk': self.pk})
+
+    def is_concurrent(self):
+        if self.concurrent is None:
+            return app_settings.CONCURRENT_WIDGETS
+        return self.concurrent
+
+    def evaluate_widgets(self, groups):
+        # Runs widgets' data methods on a thread pool, so the template
+        # gets everything evaluated and doesn't wait for every query
+        groups = list(groups)
+        max_workers = self.max_workers or app_settings.MAX_WORKERS
+        evaluate_widgets(self.get_inline_widgets(groups), max_workers)
+        return groups
+
+    async def aevaluate_widgets(self, groups):
+        # Same for async views, the page takes about as long
+        # as the slowest widget does
+        groups = list(groups)
+        max_workers = self.max_workers or app_settings.MAX_WORKERS
+        await aevaluate_widgets(self.get_inline_widgets(groups), max_workers)
+        return groups
+
+    def get_inline_widgets(self, groups):
+        # Deferred widgets are loaded separately
+        if self.is_deferred():
+            return []
+        return [widget for widget in itertools.chain.from_iterable(groups)
+                if not widget.is_deferred()]
+
+
+def load_dashboards():
+    dashboards = OrderedDict()
+    for slug, path in enumerate(app_settings.DASHBOARDS):
+        if isinstance(path, (list, tuple)):
+            slug, path = path
+        pk = str(slug)
+        if pk in dashboards:
+            raise ImproperlyConfigured(
+                'Dashboard "{}" is defined more than once.'.format(pk))
+        klass = import_string(path)
+        dashboards[pk] = klass(pk=pk)
+
+    if not dashboards:
+        raise ImproperlyConfigured('No dashboards found.')
+    return dashboards
+
+
+def get_dashboards():
+    """
+    Returns dashboards by pk. They are loaded once per process
+    and reloaded if the setting is changed.
+    """
+    global _registry
+    source = list(app_settings.DASHBOARDS)
+    registry = _registry
+    if registry is None or registry[0] != source:
+        with _registry_lock:
+            registry = _registry = (source, load_dashboards())
+    return registry[1]
+
+
+@receiver(setting_changed)
+def reset_dashboards(setting=None, **kwargs):
+    global _registry
+    if setting is None or setting.startswith('CONTROLCENTER_'):
+        _registry = None
@@ -0,0 +1,112 @@
+"""
+Reduces number of chart's points, so huge series don't hang the browser.
+Functions return sorted indices of the points to keep, so labels
+and other series can be kept in sync.
+"""
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__all__ = ['lttb', 'minmax']
+
+
+def _numbers(values):
+    # Gaps are drawn as they are, but are zeros to compare with
+    return [0.0 if x is None else float(x) for x in values]
+
+
+def _lttb(xs, ys, threshold):
+    n = len(ys)
+    every = (n - 2) / (threshold - 2)
+    indices = [0]
+    a = 0
+    for i in range(threshold - 2):
+        # Average of the next bucket is the third point of triangles
+        start = int((i + 1) * every) + 1
+        end = min(int((i + 2) * every) + 1, n)
+        avg_x = sum(xs[start:end]) / (end - start)
+        avg_y = sum(ys[start:end]) / (end - start)
+
+        best, best_area = None, -1
+        for j in range(int(i * every) + 1, start):
+            area = abs((xs[a] - avg_x) * (ys[j] - ys[a]) -
+                       (xs[a] - xs[j]) * (avg_y - ys[a]))
+            if area > best_area:
+                best, best_area = j, area
+        indices.append(best)
+        a = best
+    indices.append(n - 1)
+    return indices
+
+
+def _lttb_numpy(xs, ys, threshold):
+    xs, ys = numpy.asarray(xs), numpy.asarray(ys)
+    n = len(ys)
+    every = (n - 2) / (threshold - 2)
+    indices = [0]
+    a = 0
+    for i in range(threshold - 2):
+        start = int((i + 1) * every) + 1
+        end = min(int((i + 2) * every) + 1, n)
+        avg_x = xs[start:end].mean()
+        avg_y = ys[start:end].mean()
+
+        lo = int(i * every) + 1
+        areas = numpy.abs((xs[a] - avg_x) * (ys[lo:start] - ys[a]) -
+                          (xs[a] - xs[lo:start]) * (avg_y - ys[a]))
+        a = lo + int(areas.argmax())
+        indices.append(a)
+    indices.append(n - 1)
+    return indices
+
+
+def lttb(ys, threshold, xs=None):
+    """
+    Largest-Triangle-Three-Buckets: keeps the points which shape
+    the line the most. Runs in linear time.
+    """
+    n = len(ys)
+    if threshold >= n:
+        return list(range(n))
+    if threshold < 3:
+        # Too few for a triangle, the edges are kept
+        return [0, n - 1][:max(threshold, 0)]
+
+    ys = _numbers(ys)
+    xs = list(range(n)) if xs is None else _numbers(xs)
+    if numpy is not None:
+        return _lttb_numpy(xs, ys, threshold)
+    return _lttb(xs, ys, threshold)
+
+
+def minmax(ys, threshold, xs=None):
+    """
+    Keeps the smallest and the largest values of every bucket,
+    so bars' envelope is the same. Runs in linear time.
+    """
+    n = len(ys)
+    if threshold >= n:
+        return list(range(n))
+
+    ys = _numbers(ys)
+    if threshold < 2:
+        # Too few for a bucket, the largest value is kept
+        return [max(range(n), key=ys.__getitem__)][:max(threshold, 0)]
+    if numpy is not None:
+        ys = numpy.asarray(ys)
+
+    buckets = threshold // 2
+    every = n / buckets
+    indices = []
+    for i in range(buckets):
+        start, end = int(i * every), int((i + 1) * every)
+        bucket = ys[start:end]
+        if numpy is not None:
+            low, high = int(bucket.argmin()), int(bucket.argmax())
+        else:
+            low = min(range(len(bucket)), key=bucket.__getitem__)
+            high = max(range(len(bucket)), key=bucket.__getitem__)
+        indices.extend(sorted({start + low, start + high}))
+    return indices
@@ -0,0 +1,101 @@
+import itertools
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+
+from ...concurrency import evaluate_widget, evaluate_widgets
+from ...dashboards import get_dashboards
+
+
+class Command(BaseCommand):
+    help = 'Fills widgets\' data cache.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-d', '--dashboard', action='append', dest='dashboards',
+            help='Dashboard pk to warm, all dashboards by default.')
+        parser.add_argument(
+            '-w', '--widget', action='append', dest='widgets',
+            help='Widget slug to warm, all widgets by default.')
+        parser.add_argument(
+            '-u', '--user', dest='username',
+            help='Username of staff user to build requests with, '
+                 'the first active superuser by default.')
+        parser.add_argument(
+            '-p', '--parallel', type=int, default=1,
+            help='Number of threads to evaluate widgets with.')
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Warms caches over and over again.')
+        parser.add_argument(
+            '--interval', type=float, default=60,
+            help='Seconds to sleep between warmings in loop mode.')
+
+    def handle(self, **options):
+        dashboards = get_dashboards()
+        if options['dashboards']:
+            unknown = set(options['dashboards']).difference(dashboards)
+            if unknown:
+                raise CommandError('Unknown dashboards: {}'
+                                   .format(', '.join(sorted(unknown))))
+            dashboards = [dashboards[x] for x in options['dashboards']]
+        else:
+            dashboards = list(dashboards.values())
+
+        user = self.get_user(options['username'])
+        while True:
+            self.warm(dashboards, user, options['widgets'],
+                      options['parallel'])
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+    def get_user(self, username):
+        user_model = get_user_model()
+        users = user_model._default_manager.filter(is_active=True,
+                                                   is_staff=True)
+        if username:
+            users = users.filter(**{user_model.USERNAME_FIELD: username})
+        else:
+            users = users.filter(is_superuser=True).order_by('pk')
+
+        user = users.first()
+        if user is None:
+            raise CommandError('No active staff user found.')
+        return user
+
+    def get_request(self, dashboard, user):
+        request = RequestFactory().get(dashboard.get_absolute_url())
+        request.user = user
+        return request
+
+    def warm(self, dashboards, user, slugs, parallel):
+        widgets = []
+        for dashboard in dashboards:
+            request = self.get_request(dashboard, user)
+            for widget in itertools.chain.from_iterable(
+                    dashboard.get_widgets(request)):
+                if slugs and widget.slug not in slugs:
+                    continue
+                if not widget.data_cache_timeout:
+                    # Nothing to fill
+                    continue
+                # Computes values even if there are fresh ones
+                widget.refresh_cache = True
+                widgets.append(widget)
+
+        started = time.perf_counter()
+        if parallel > 1:
+            evaluate_widgets(widgets, max_workers=parallel)
+        else:
+            for widget in widgets:
+                evaluate_widget(widget)
+
+        for widget in widgets:
+            self.stdout.write('{}.{}: {:.3f}s'.format(
+                widget.dashboard.pk, widget.slug,
+                sum(widget.timings.values())))
+        self.stdout.write('Warmed {} widgets in {:.3f}s'.format(
+            len(widgets), time.perf_counter() - started))
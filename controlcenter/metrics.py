@@ -0,0 +1,212 @@
+"""
+Widgets' evaluation metrics, aggregated within the process.
+"""
+
+import threading
+
+__all__ = ['record', 'record_breach', 'get_metrics', 'reset_metrics',
+           'observe', 'increment', 'record_widget', 'exposition',
+           'CONTENT_TYPE']
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds of histograms' buckets
+TIME_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+# Name: type, help, buckets
+FAMILIES = {
+    'controlcenter_widget_evaluation_seconds': (
+        'histogram', "Time spent on widget's data methods.", TIME_BUCKETS),
+    'controlcenter_widget_queries': (
+        'histogram', "Queries made by widget's data methods.",
+        QUERY_BUCKETS),
+    'controlcenter_widget_render_seconds': (
+        'histogram', "Time spent on widget's template.", TIME_BUCKETS),
+    'controlcenter_widget_cache_requests_total': (
+        'counter', "Widget's cache lookups by cache and result.", None),
+    'controlcenter_widget_timeouts_total': (
+        'counter', 'Widgets which have not been evaluated in time.', None),
+    'controlcenter_widget_budget_breaches_total': (
+        'counter', 'Widgets which have exceeded their budget.', None),
+}
+
+_metrics = {}
+# Name: {labels: Histogram or number}
+_families = {}
+_lock = threading.Lock()
+
+
+class WidgetMetrics(object):
+    def __init__(self):
+        self.evaluations = 0
+        self.queries = 0
+        self.sql_time = 0.0
+        self.time = 0.0
+        self.max_time = 0.0
+        self.breaches = 0
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+def _get(name):
+    metrics = _metrics.get(name)
+    if metrics is None:
+        metrics = _metrics[name] = WidgetMetrics()
+    return metrics
+
+
+def record(name, queries, sql_time, duration):
+    """
+    Records an evaluation of widget's cached attribute.
+    Time is in seconds.
+    """
+    with _lock:
+        metrics = _get(name)
+        metrics.evaluations += 1
+        metrics.queries += queries
+        metrics.sql_time += sql_time
+        metrics.time += duration
+        metrics.max_time = max(metrics.max_time, duration)
+
+
+def record_breach(name):
+    with _lock:
+        _get(name).breaches += 1
+
+
+def get_metrics():
+    """
+    Returns metrics of every widget evaluated by the process by name.
+    """
+    with _lock:
+        return {name: x.as_dict() for name, x in _metrics.items()}
+
+
+def reset_metrics():
+    with _lock:
+        _metrics.clear()
+        _families.clear()
+
+
+class Histogram(object):
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # Cumulative, as they're exposed
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _labels(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def observe(name, value, **labels):
+    """
+    Adds the value to the histogram with the labels.
+    """
+    buckets = FAMILIES[name][2]
+    with _lock:
+        family = _families.setdefault(name, {})
+        key = _labels(labels)
+        histogram = family.get(key)
+        if histogram is None:
+            histogram = family[key] = Histogram(buckets)
+        histogram.observe(value)
+
+
+def increment(name, value=1, **labels):
+    with _lock:
+        family = _families.setdefault(name, {})
+        key = _labels(labels)
+        family[key] = family.get(key, 0) + value
+
+
+def record_widget(widget):
+    """
+    Records what the widget has cost the request.
+    """
+    profile = widget.get_profile()
+    dashboard = getattr(widget.dashboard, 'pk', None) or ''
+    labels = {'dashboard': dashboard, 'widget': widget.slug}
+
+    if profile['timed_out']:
+        increment('controlcenter_widget_timeouts_total', **labels)
+        return
+
+    observe('controlcenter_widget_evaluation_seconds',
+            profile['data_time'] / 1000, **labels)
+    observe('controlcenter_widget_queries', profile['queries'], **labels)
+    observe('controlcenter_widget_render_seconds',
+            profile['render_time'] / 1000, **labels)
+    if widget.over_budget:
+        increment('controlcenter_widget_budget_breaches_total', **labels)
+
+    lookups = (
+        ('data', 'hit', widget.data_cache_hits),
+        ('data', 'miss', widget.data_cache_misses),
+        ('body', profile['body_cache'], 1),
+    )
+    for cache, result, count in lookups:
+        if result and count:
+            increment('controlcenter_widget_cache_requests_total', count,
+                      cache=cache, result=result, **labels)
+
+
+def _escape(value):
+    return (value.replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def _format_labels(labels, **extra):
+    labels = list(labels) + list(extra.items())
+    if not labels:
+        return ''
+    return '{{{}}}'.format(','.join(
+        '{}="{}"'.format(key, _escape(value)) for key, value in labels))
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def exposition():
+    """
+    Returns the metrics in Prometheus text exposition format.
+    """
+    lines = []
+    with _lock:
+        for name, (kind, help_text, buckets) in FAMILIES.items():
+            family = _families.get(name)
+            if not family:
+                continue
+            lines.append('# HELP {} {}'.format(name, help_text))
+            lines.append('# TYPE {} {}'.format(name, kind))
+            for labels, value in sorted(family.items()):
+                if kind != 'histogram':
+                    lines.append('{}{} {}'.format(
+                        name, _format_labels(labels), _format_value(value)))
+                    continue
+
+                for bound, count in zip(buckets, value.counts):
+                    lines.append('{}_bucket{} {}'.format(
+                        name, _format_labels(labels, le=_format_value(bound)),
+                        count))
+                lines.append('{}_bucket{} {}'.format(
+                    name, _format_labels(labels, le='+Inf'), value.count))
+                lines.append('{}_sum{} {}'.format(
+                    name, _format_labels(labels), _format_value(value.sum)))
+                lines.append('{}_count{} {}'.format(
+                    name, _format_labels(labels), value.count))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,43 @@
+"""
+JSON serializers of widgets' data. ``CONTROLCENTER_JSON_SERIALIZER``
+is a dotted path to a function which gets an object and returns a string.
+"""
+
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.module_loading import import_string
+
+from . import app_settings
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+__all__ = ['dumps', 'stdlib_dumps', 'orjson_dumps', 'get_serializer']
+
+# Django's types are serialized the same way with any backend
+_default = DjangoJSONEncoder().default
+
+
+def stdlib_dumps(obj):
+    return json.dumps(obj, cls=DjangoJSONEncoder, separators=(',', ':'))
+
+
+def orjson_dumps(obj):
+    return orjson.dumps(
+        obj, default=_default,
+        option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME,
+    ).decode('utf-8')
+
+
+def dumps(obj):
+    # The fastest backend installed
+    if orjson is not None:
+        return orjson_dumps(obj)
+    return stdlib_dumps(obj)
+
+
+def get_serializer():
+    return import_string(app_settings.JSON_SERIALIZER)
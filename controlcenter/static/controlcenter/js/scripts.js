@@ -1,6 +1,247 @@
+var controlcenter = {
+    // Chartist instances by selector
+    charts: {},
+    masonry: null,
+    legend_classes: 'abcdefghijklmno',
+
+    layout: function(){
+        if (this.masonry){
+            this.masonry.layout();
+        }
+    },
+
+    request: function(url, options){
+        options = options || {};
+        options.credentials = 'same-origin';
+        options.headers = options.headers || {};
+        options.headers['X-Requested-With'] = 'XMLHttpRequest';
+        return fetch(url, options).then(function(response){
+            if (!response.ok && response.status !== 304){
+                throw new Error(response.statusText);
+            }
+            return response;
+        });
+    },
+
+    setHTML: function(node, html){
+        node.innerHTML = html;
+        // Scripts inserted with innerHTML are not executed
+        [].map.call(node.querySelectorAll('script'), function(old){
+            var script = document.createElement('script');
+            script.text = old.text;
+            old.parentNode.replaceChild(script, old);
+        });
+        this.layout();
+    },
+
+    decodeSeries: function(series){
+        // Columnar series are expanded to points
+        return (series || []).map(function(values){
+            if (!values || Array.isArray(values) || !values.y){
+                return values;
+            }
+            var x = 0;
+            return values.y.map(function(y, i){
+                x = values.delta ? x + values.x[i] : values.x[i];
+                return {x: x, y: y};
+            });
+        });
+    },
+
+    renderChart: function(selector, data, config){
+        var options = JSON.parse(JSON.stringify(config.options || {}));
+
+        data = {labels: data.labels, series: this.decodeSeries(data.series)};
+
+        if (config.klass === 'Line' && config.point_labels){
+            options.plugins = [
+                Chartist.plugins.ctPointLabels({
+                    textAnchor: 'middle',
+                    // NOTE: chartist-plugin-pointlabels (as of 0.0.6) will always display both the x and y labels.
+                    // This is not useful for time series data, and not configurable yet,
+                    // so as a workaround, split the combined label and return only the desired y value.
+                    labelInterpolationFnc: config.time_series ? function(label){
+                        return label.split(', ')[1];
+                    } : function(label){
+                        return label ? label : 0;
+                    }
+                })
+            ];
+        }
+
+        if (config.time_series){
+            // For TimeSeriesChart, change the X axis to use FixedScaleAxis, and format human-readable labels.
+            options.axisX = options.axisX || {};
+            options.axisX.type = Chartist.FixedScaleAxis;
+            options.axisX.labelInterpolationFnc = function(timestamp){  // Assume POSIX timestamp in seconds
+                return new Date(timestamp * 1000).toLocaleString(undefined, config.timestamp_options);
+            };
+        }
+
+        var chart = new Chartist[config.klass](selector, data, options);
+        this.charts[selector] = chart;
+        return chart;
+    },
+
+    renderLegend: function(node, legend){
+        var self = this,
+            offset = document.createElement('div');
+
+        offset.className = 'controlcenter__chart-legend__offset';
+        legend.forEach(function(label, i){
+            var series = document.createElement('div'),
+                color = document.createElement('div'),
+                text = document.createElement('div'),
+                letter = self.legend_classes[i % self.legend_classes.length];
+
+            series.className = 'controlcenter__chart-legend__series';
+            color.className = 'controlcenter__chart-legend__series__color ct-legend-' + letter;
+            text.className = 'controlcenter__chart-legend__series__label';
+            text.textContent = label;
+            series.appendChild(color);
+            series.appendChild(text);
+            offset.appendChild(series);
+        });
+        node.innerHTML = '';
+        node.appendChild(offset);
+    },
+
+    updateChart: function(selector, data){
+        var chart = this.charts[selector],
+            legend = document.querySelector(selector + '_legend');
+
+        if (chart){
+            chart.update({labels: data.labels, series: this.decodeSeries(data.series)});
+        } else if (data.series && data.series.length){
+            this.renderChart(selector, {labels: data.labels, series: data.series}, data.chartist);
+        }
+        if (legend && data.legend && data.legend.length){
+            this.renderLegend(legend, data.legend);
+        }
+        this.layout();
+    },
+
+    lastX: function(selector){
+        // The latest timestamp of time series chart, if it's drawn
+        var chart = this.charts[selector],
+            last = null;
+
+        if (!chart || !chart.data || !chart.data.series){
+            return last;
+        }
+        chart.data.series.forEach(function(values){
+            var point = values && values[values.length - 1];
+            if (point && typeof point.x === 'number' && (last === null || point.x > last)){
+                last = point.x;
+            }
+        });
+        return last;
+    },
+
+    mergeChart: function(selector, data){
+        // Replaces points since the given one,
+        // and drops the ones out of the window
+        var chart = this.charts[selector],
+            series = this.decodeSeries(data.series);
+
+        if (!chart){
+            return;
+        }
+        chart.update({
+            labels: chart.data.labels,
+            series: chart.data.series.map(function(values, i){
+                return values.filter(function(point){
+                    return point.x < data.since && (data.start === null || point.x >= data.start);
+                }).concat(series[i] || []);
+            })
+        });
+        this.layout();
+    },
+
+    fetchChart: function(selector, url){
+        var self = this;
+        return this.request(url).then(function(response){
+            return response.json();
+        }).then(function(data){
+            self.updateChart(selector, data);
+        });
+    },
+
+    refresh: function(body, data){
+        // Updates widget with the data provided or fetches it.
+        // Server responds with 304 if nothing has changed since the last time
+        var self = this,
+            url = body.getAttribute('data-refresh-src'),
+            chart = body.getAttribute('data-chart'),
+            headers = {};
+
+        if (data && chart){
+            self.updateChart('#' + chart, data);
+            return Promise.resolve();
+        }
+        if (chart && self.lastX('#' + chart) !== null){
+            // Time series get the new points only
+            url += (url.indexOf('?') < 0 ? '?' : '&') + 'since=' + self.lastX('#' + chart);
+        }
+        if (body.getAttribute('data-etag')){
+            headers['If-None-Match'] = body.getAttribute('data-etag');
+        }
+        return self.request(url, {headers: headers, cache: 'no-store'}).then(function(response){
+            if (response.status === 304){
+                return;
+            }
+            body.setAttribute('data-etag', response.headers.get('ETag') || '');
+            if (chart){
+                return response.json().then(function(data){
+                    if (data.since !== undefined){
+                        self.mergeChart('#' + chart, data);
+                    } else {
+                        self.updateChart('#' + chart, data);
+                    }
+                });
+            }
+            return response.text().then(function(html){
+                self.setHTML(body, html);
+            });
+        });
+    },
+
+    poll: function(body){
+        // Fetches widget's data or html over and over again
+        var self = this,
+            interval = parseFloat(body.getAttribute('data-refresh')) * 1000;
+
+        function tick(){
+            if (document.hidden){
+                return;
+            }
+            self.refresh(body).catch(function(){
+                // Keeps showing the old data, next time might be better
+            });
+        }
+        return setInterval(tick, interval);
+    },
+
+    listen: function(url){
+        // Server tells which widget has changed, EventSource reconnects
+        // on its own if connection is lost
+        var self = this,
+            source = new EventSource(url);
+
+        source.addEventListener('widget', function(e){
+            var event = JSON.parse(e.data),
+                body = document.querySelector('.controlcenter__widget__body[data-widget="' + event.widget + '"]');
+            if (body){
+                self.refresh(body, event.data).catch(function(){});
+            }
+        });
+        return source;
+    }
+};
+
 document.addEventListener('DOMContentLoaded', function(){
     // GRID
-    var msnry = new Masonry('.controlcenter__masonry__offset', {
+    controlcenter.masonry = new Masonry('.controlcenter__masonry__offset', {
         itemSelector: '.controlcenter__masonry__block',
         columnWidth: '.controlcenter__masonry__block--sizer',
         percentPosition: true,
@@ -22,4 +263,51 @@ document.addEventListener('DOMContentLoaded', function(){
             tab.classList.add(tab_klass_active);
         }, false);
     });
+
+    // DEFERRED WIDGETS
+    var body_nodes = document.querySelectorAll('.controlcenter__widget__body[data-src]');
+
+    [].map.call(body_nodes, function(body){
+        controlcenter.request(body.getAttribute('data-src')).then(function(response){
+            return response.text();
+        }).then(function(html){
+            controlcenter.setHTML(body, html);
+        }).catch(function(){
+            controlcenter.setHTML(body, '<div class="controlcenter__widget__loading">Failed to load</div>');
+        });
+    });
+
+    // PAGINATION AND RETRIES
+    document.addEventListener('click', function(e){
+        var link = e.target.closest ? e.target.closest('a[data-page], a[data-retry]') : null,
+            body = link && link.closest('.controlcenter__widget__body');
+        if (!body){
+            return;
+        }
+        e.preventDefault();
+        controlcenter.request(link.getAttribute('href')).then(function(response){
+            return response.text();
+        }).then(function(html){
+            controlcenter.setHTML(body, html);
+            if (link.hasAttribute('data-page') && body.hasAttribute('data-refresh-src')){
+                // Refreshes keep the page and the sort user has chosen
+                body.setAttribute('data-refresh-src', link.getAttribute('href'));
+                body.removeAttribute('data-etag');
+            }
+        });
+    }, false);
+
+    // AUTO-REFRESH
+    var refresh_nodes = document.querySelectorAll('.controlcenter__widget__body[data-refresh]');
+
+    [].map.call(refresh_nodes, function(body){
+        controlcenter.poll(body);
+    });
+
+    // LIVE UPDATES
+    var stream_node = document.querySelector('.controlcenter[data-stream]');
+
+    if (stream_node && window.EventSource){
+        controlcenter.listen(stream_node.getAttribute('data-stream'));
+    }
 }, false);
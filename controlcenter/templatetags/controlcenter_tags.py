@@ -1,25 +1,21 @@
-import json
-from collections.abc import Sequence, Mapping
-from functools import partial
+import time
+from collections.abc import Sequence
 
 from django import template
-from django.core.exceptions import FieldDoesNotExist
-from django.core.serializers.json import DjangoJSONEncoder
-from django.db import models
 from django.db.models.base import ModelBase
-from django.urls import NoReverseMatch, reverse
-from django.utils.html import conditional_escape, format_html, mark_safe
+from django.urls import reverse
+from django.utils.html import format_html, mark_safe
 from django.utils.http import urlencode
 
-from .. import app_settings
-from ..utils import indexonly
+from .. import app_settings, serializers
+from ..widgets.core import ChangeUrls, Column, _method_prop  # noqa: F401
 
 register = template.Library()
 
 
 @register.filter
 def jsonify(obj):
-    return mark_safe(json.dumps(obj, cls=DjangoJSONEncoder))
+    return mark_safe(serializers.get_serializer()(obj))
 
 
 @register.filter
@@ -29,45 +25,11 @@ def is_sequence(obj):
 
 @register.simple_tag
 def change_url(widget, obj):
-
-    if not widget.model and not isinstance(obj, models.Model):
-        # No chance to get model url
-        return
-
-    elif isinstance(obj, Mapping):
-        pk = obj.get('pk', obj.get('id'))
-        meta = widget.model._meta
-
-    elif indexonly(obj):
-        if not widget.list_display:
-            # No chance to guess pk
-            return
-        # Excludes sharp tip zip keys and values
-        keys = (k for k in widget.list_display if k != app_settings.SHARP)
-        new_obj = {x: y for x, y in zip(keys, obj)}
-        return change_url(widget, new_obj)
-    else:
-        pk = getattr(obj, 'pk', getattr(obj, 'id', None))
-        if not isinstance(obj, models.Model):
-            # Namedtuples and custom stuff
-            meta = widget.model._meta
-        elif getattr(obj, '_deferred', False):  # pragma: no cover
-            # Deferred model
-            meta = obj._meta.proxy_for_model._meta
-        else:
-            # Regular model or django 1.10 deferred
-            meta = obj._meta
-
-    if pk is None:
-        # No chance to get item url
-        return
-
-    try:
-        app_label, model_name = meta.app_label, meta.model_name
-        return reverse('admin:{}_{}_change'.format(app_label, model_name),
-                       args=[pk])
-    except NoReverseMatch:
-        return
+    get_change_url = getattr(widget, 'get_change_url', None)
+    if get_change_url is not None:
+        # Reuses widget's resolved urls
+        return get_change_url(obj)
+    return ChangeUrls(widget)(obj)
 
 
 @register.filter
@@ -113,79 +75,16 @@ def attrvalue(widget, obj, attrname):
     Then tries to get one from object (dict, sequence, model,
     namedtuple, whatever looks alike).
     """
-
-    # Looks for a callable in widget
-    attr = getattr(widget, attrname, None)
-    if attr and callable(attr):
-        value = attr(obj)
-    elif isinstance(obj, Mapping):
-        # Manager.values()
-        value = obj.get(attrname)
-    elif indexonly(obj):
-        # Fist removes sharp from the list
-        clone = list(widget.list_display or ())
-        if app_settings.SHARP in clone:
-            clone.remove(app_settings.SHARP)
-
-        if attrname not in clone:
-            value = None
-        else:
-            index = clone.index(attrname)
-            try:
-                # Obj might be shorter
-                value = obj[index]
-            except IndexError:
-                value = None
-    else:
-        # Model, namedtuple, custom stuff
-        attr = getattr(obj, attrname, None)
-        value = attr() if callable(attr) else attr
-
-    if value is None:
-        # It's not found or the value is None
-        return ''
-    elif attr and getattr(attr, 'allow_tags', False):
-        return mark_safe(value)
-    else:
-        # TODO: django 1.9 auto-escapes simple_tag
-        return conditional_escape(value)
-
-
-def _method_prop(obj, attrname, attrprop):
-    """
-    Returns property of callable object's attribute.
-    """
-    attr = getattr(obj, attrname, None)
-    if attr and callable(attr):
-        return getattr(attr, attrprop, None)
-
-
-_method_label = partial(_method_prop, attrprop='short_description')
+    # Fist removes sharp from the list
+    names = [x for x in widget.list_display or ()
+             if x != app_settings.SHARP]
+    index = names.index(attrname) if attrname in names else None
+    return Column(widget, attrname, index).render(obj)
 
 
 @register.filter
 def attrlabel(widget, attrname):
-    widget_prop = _method_label(widget, attrname)
-    if widget_prop is not None:
-        return widget_prop
-
-    elif widget.model:
-        model_prop = _method_label(widget.model, attrname)
-        if model_prop is not None:
-            # Allows to have empty description
-            return model_prop
-
-        if attrname == 'pk':
-            fieldname = widget.model._meta.pk.name
-        else:
-            fieldname = attrname
-
-        try:
-            field = widget.model._meta.get_field(fieldname)
-            return field.verbose_name
-        except FieldDoesNotExist:
-            pass
-    return attrname
+    return Column(widget, attrname).label
 
 
 @register.simple_tag
@@ -195,3 +94,38 @@ def external_link(url, label=None):
         'rel="noreferrer" rel="noopener">{label}</a>',
         href=url, label=label or url,
     )
+
+
+class TimedNode(template.Node):
+    def __init__(self, widget, nodelist):
+        self.widget = widget
+        self.nodelist = nodelist
+
+    def render(self, context):
+        widget = self.widget.resolve(context)
+        evaluation_time = widget.evaluation_time
+        started = time.perf_counter()
+        output = self.nodelist.render(context)
+        duration = time.perf_counter() - started
+        # Lazy values are evaluated within the template,
+        # but they're not a part of rendering
+        widget.render_time += duration - (widget.evaluation_time -
+                                          evaluation_time)
+        widget.renders += 1
+        return output
+
+
+@register.tag
+def timed(parser, token):
+    """
+    Adds rendering time of the block to the widget's render_time.
+
+        {% timed widget %}...{% endtimed %}
+    """
+    bits = token.split_contents()
+    if len(bits) != 2:
+        raise template.TemplateSyntaxError(
+            '{} tag requires a widget'.format(bits[0]))
+    nodelist = parser.parse(('endtimed',))
+    parser.delete_first_token()
+    return TimedNode(parser.compile_filter(bits[1]), nodelist)
@@ -1,8 +1,11 @@
+import contextlib
+import time
 from collections.abc import Sequence
 
+from django.db import connections
 from django.utils.text import camel_case_to_spaces, capfirst
 
-__all__ = ['captitle', 'deepmerge']
+__all__ = ['captitle', 'count_queries', 'deepmerge']
 
 
 def captitle(title):
@@ -26,3 +29,30 @@ def indexonly(obj):
     # If your custom class instance passed this, then why did you do that?
     return (isinstance(obj, Sequence) and not
             hasattr(obj, '_make') and not hasattr(obj, '_replace'))
+
+
+class QueryCounter(object):
+    def __init__(self):
+        self.count = 0
+        # Seconds spent in the database
+        self.time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.time += time.perf_counter() - started
+
+
+@contextlib.contextmanager
+def count_queries():
+    """
+    Counts queries made by the current thread with any database.
+    """
+    counter = QueryCounter()
+    with contextlib.ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(counter))
+        yield counter
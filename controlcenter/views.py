@@ -1,37 +1,155 @@
-from collections import OrderedDict
+import hashlib
+import time
 
+from django import VERSION as DJANGO_VERSION
 from django.contrib import admin
 from django.contrib.admin.views.decorators import staff_member_required
+from django.contrib.auth.views import redirect_to_login
 from django.core.exceptions import ImproperlyConfigured
-from django.http import Http404, HttpResponseRedirect
+from django.http import (
+    Http404,
+    HttpResponse,
+    HttpResponseForbidden,
+    HttpResponseRedirect,
+    StreamingHttpResponse,
+)
 from django.shortcuts import redirect
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.crypto import constant_time_compare
 from django.utils.decorators import method_decorator
 from django.utils.functional import cached_property
-from django.utils.module_loading import import_string
-from django.views.generic.base import TemplateView
+from django.utils.http import http_date, quote_etag
+from django.utils.translation import get_language
+from django.views.generic.base import TemplateView, View
 
-from . import app_settings
+from . import app_settings, broadcast, cache, metrics, serializers
+from .concurrency import evaluate_widgets
+from .dashboards import get_dashboards
 
 try:
     from django.urls import re_path
 except ImportError:
     from django.conf.urls import url as re_path
 
+try:
+    from asgiref.sync import sync_to_async
+    from django.core.handlers.asgi import ASGIRequest
+except ImportError:
+    # Django < 3.0 has no ASGI support
+    sync_to_async = ASGIRequest = None
+
+# StreamingHttpResponse takes async iterators since Django 4.2
+ASYNC_STREAMING = DJANGO_VERSION >= (4, 2)
+
+
+def can_stream(request):
+    """
+    Returns False if the stream would block the event loop,
+    older Django iterates it there under ASGI.
+    """
+    return (ASYNC_STREAMING or ASGIRequest is None or
+            not isinstance(request, ASGIRequest))
+
+
+
+def conditional_response(request, content, content_type,
+                         last_modified=None):
+    """
+    Returns the content with ETag and Last-Modified headers,
+    or 304 Not Modified if client has got it already.
+    """
+    etag = quote_etag(hashlib.md5(content.encode('utf-8')).hexdigest())
+    last_modified = last_modified and int(last_modified)
+    response = get_conditional_response(request, etag=etag,
+                                        last_modified=last_modified)
+    if response is None:
+        response = HttpResponse(content, content_type=content_type)
+    set_validators(response, etag, last_modified)
+    return response
+
+
+def set_validators(response, etag, last_modified=None):
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified)
+    # Browser must check it's fresh every time
+    patch_cache_control(response, private=True, no_cache=True)
+
+
+def server_timing(widgets, total=None):
+    """
+    Returns Server-Timing header value with widgets' breakdown,
+    so slow ones are seen in browser's devtools.
+    """
+    entries = []
+    for widget in widgets:
+        profile = widget.get_profile()
+        if profile['timed_out']:
+            desc = ['timed out']
+        else:
+            desc = ['{} queries'.format(profile['queries'])]
+        for name in ('data_cache', 'body_cache'):
+            if profile[name]:
+                desc.append('{} {}'.format(name.replace('_', ' '),
+                                           profile[name]))
+        entries.append('{}-data;dur={:.1f};desc="{}"'.format(
+            widget.slug, profile['data_time'], ', '.join(desc)))
+        entries.append('{}-render;dur={:.1f}'.format(
+            widget.slug, profile['render_time']))
+    if total is not None:
+        entries.append('total;dur={:.1f}'.format(total * 1000))
+    return ', '.join(entries)
 
 
 class ControlCenter(object):
-    def __init__(self, name, view_class):
+    def __init__(self, name, view_class, widget_view_class=None,
+                 data_view_class=None, stream_view_class=None,
+                 metrics_view_class=None):
         self.name = name
         self.view_class = view_class
+        self.widget_view_class = widget_view_class
+        self.data_view_class = data_view_class
+        self.stream_view_class = stream_view_class
+        self.metrics_view_class = metrics_view_class
 
     def get_view(self):
         return self.view_class.as_view(controlcenter=self)
 
+    def get_widget_view(self):
+        return self.widget_view_class.as_view(controlcenter=self)
+
+    def get_data_view(self):
+        return self.data_view_class.as_view(controlcenter=self)
+
+    def get_stream_view(self):
+        return self.stream_view_class.as_view(controlcenter=self)
+
+    def get_metrics_view(self):
+        return self.metrics_view_class.as_view(controlcenter=self)
+
     def get_urls(self):
         urlpatterns = [
             re_path(r'^$', self.get_view(), name='index'),
             re_path(r'^(?P<pk>\w+)/$', self.get_view(), name='dashboard'),
         ]
+        if self.widget_view_class:
+            urlpatterns.append(
+                re_path(r'^(?P<pk>\w+)/widget/(?P<slug>\w+)/$',
+                        self.get_widget_view(), name='widget'))
+        if self.data_view_class:
+            urlpatterns.append(
+                re_path(r'^(?P<pk>\w+)/widget/(?P<slug>\w+)/data/$',
+                        self.get_data_view(), name='widget_data'))
+        if self.stream_view_class:
+            urlpatterns.append(
+                re_path(r'^(?P<pk>\w+)/stream/$',
+                        self.get_stream_view(), name='stream'))
+        if self.metrics_view_class:
+            # Dashboards' slugs can't have a dash, so none is shadowed
+            urlpatterns.append(
+                re_path(r'^-/metrics/$', self.get_metrics_view(),
+                        name='metrics'))
         return urlpatterns
 
     @property
@@ -42,8 +160,15 @@ class ControlCenter(object):
 class DashboardView(TemplateView):
     dashboard = None
     controlcenter = None
+    groups = None
+    inline_widgets = None
+    started = None
     template_name = 'controlcenter/dashboard.html'
 
+    def setup(self, request, *args, **kwargs):
+        super(DashboardView, self).setup(request, *args, **kwargs)
+        self.started = time.perf_counter()
+
     @method_decorator(staff_member_required)
     def dispatch(self, *args, **kwargs):
         return super(DashboardView, self).dispatch(*args, **kwargs)
@@ -64,24 +189,54 @@ class DashboardView(TemplateView):
 
     @cached_property
     def dashboards(self):
-        dashboards = OrderedDict()
-        for slug, path in enumerate(app_settings.DASHBOARDS):
-            if isinstance(path, (list, tuple)):
-                slug, path = path
-            pk = str(slug)
-            klass = import_string(path)
-            dashboards[pk] = klass(pk=pk)
-
-        if not dashboards:
-            raise ImproperlyConfigured('No dashboards found.')
-        return dashboards
+        return get_dashboards()
+
+    def get_groups(self):
+        groups = self.dashboard.get_widgets(self.request)
+        if self.dashboard.is_concurrent():
+            groups = self.dashboard.evaluate_widgets(groups)
+        return groups
+
+    def is_profiling(self):
+        user = getattr(self.request, 'user', None)
+        return bool(self.request.GET.get('_cc_profile') and
+                    user is not None and user.is_staff)
+
+    def render_to_response(self, context, **response_kwargs):
+        response = super(DashboardView, self).render_to_response(
+            context, **response_kwargs)
+        response.add_post_render_callback(self.post_render)
+        return response
+
+    def post_render(self, response):
+        # Widgets are evaluated and rendered by then
+        self.report(response, self.inline_widgets or [])
+
+    def report(self, response, widgets):
+        """
+        Records what the widgets have cost and tells the browser.
+        """
+        if app_settings.METRICS:
+            for widget in widgets:
+                metrics.record_widget(widget)
+        if app_settings.SERVER_TIMING:
+            total = (time.perf_counter() - self.started
+                     if self.started else None)
+            response['Server-Timing'] = server_timing(widgets, total)
 
     def get_context_data(self, **kwargs):
+        # Kept for the report, widgets are gone with a generator
+        self.groups = list(self.get_groups())
+        # Widgets deferred while rendering are still reported
+        self.inline_widgets = self.dashboard.get_inline_widgets(self.groups)
         context = {
             'title': self.dashboard.title,
             'dashboard': self.dashboard,
             'dashboards': self.dashboards.values(),
-            'groups': self.dashboard.get_widgets(self.request),
+            'groups': self.groups,
+            'deferred': self.dashboard.is_deferred(),
+            'push': self.dashboard.is_push() and can_stream(self.request),
+            'profile': self.is_profiling(),
             'sharp': app_settings.SHARP,
         }
 
@@ -91,4 +246,297 @@ class DashboardView(TemplateView):
         return super(DashboardView, self).get_context_data(**kwargs)
 
 
-controlcenter = ControlCenter('controlcenter', DashboardView)
+class AsyncDashboardView(DashboardView):
+    """
+    Evaluates all the widgets concurrently on the event loop
+    before the page is rendered. Meant to be served with ASGI.
+    Requires Django 4.1 or newer.
+    """
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # Older versions can't tell the view is async
+        if DJANGO_VERSION < (4, 1):
+            raise ImproperlyConfigured(
+                'AsyncDashboardView requires Django 4.1 or newer')
+        return super(AsyncDashboardView, cls).as_view(**initkwargs)
+
+    async def dispatch(self, request, *args, **kwargs):
+        # staff_member_required can't get the user in async context
+        if not await sync_to_async(self.has_permission)(request):
+            return redirect_to_login(request.get_full_path(),
+                                     reverse('admin:login'))
+        return await super(DashboardView, self).dispatch(
+            request, *args, **kwargs)
+
+    def has_permission(self, request):
+        return request.user.is_active and request.user.is_staff
+
+    async def get(self, request, *args, **kwargs):
+        pk = self.kwargs.get('pk')
+        if not pk and self.dashboards:
+            dashboard = next(iter(self.dashboards.values()))
+            return redirect(dashboard.get_absolute_url())
+
+        try:
+            self.dashboard = self.dashboards[pk]
+        except KeyError:
+            raise Http404(f'Dashboard "{pk}" not found')
+
+        self.groups = await self.dashboard.aevaluate_widgets(
+            self.dashboard.get_widgets(request))
+        # Admin context requires the user and such
+        context = await sync_to_async(self.get_context_data)(**kwargs)
+        return self.render_to_response(context)
+
+    def get_groups(self):
+        return self.groups
+
+
+class WidgetView(DashboardView):
+    widget = None
+    template_name = 'controlcenter/widget.html'
+    # Query parameters passed to the widget as options
+    widget_params = ('cursor', 'o')
+
+    def get(self, request, *args, **kwargs):
+        self.widget = self.get_widget()
+        response = self.get_not_modified()
+        if response is not None:
+            return response
+
+        if self.widget.timeout is not None:
+            # Retries of timed out widgets must not hang either
+            evaluate_widgets([self.widget])
+        response = super(DashboardView, self).get(request, *args, **kwargs)
+        # Html is compared with what client has got, the widget has
+        # to be rendered for that unless its data is cached
+        response.render()
+        response = conditional_response(
+            request, response.content.decode(), response['Content-Type'],
+            last_modified=self.widget.last_modified)
+        self.remember_etag(response)
+        self.report(response, [self.widget])
+        return response
+
+    def get_etag_key(self):
+        # Response depends on the url, the language and whatever
+        # the widget's data and body vary on
+        widget = self.widget
+        name = widget.get_cache_name()
+        digest = cache.make_digest(
+            type(self).__name__, self.request.get_full_path(),
+            get_language(), widget.data_cache_version,
+            cache.vary_on(widget, widget.cache_vary),
+            cache.vary_on(widget, widget.data_cache_vary))
+        return cache.make_key('etag', name, cache.get_generation(name),
+                              digest)
+
+    def get_not_modified(self):
+        """
+        Returns 304 Not Modified without evaluating the widget, if client
+        has got the response made of the cached data, which is still fresh.
+        """
+        if not self.widget.data_cache_timeout:
+            return None
+        validators = cache.get_cache().get(self.get_etag_key())
+        if validators is None:
+            return None
+        etag, last_modified = validators
+        response = get_conditional_response(self.request, etag=etag,
+                                            last_modified=last_modified)
+        if response is not None:
+            set_validators(response, etag, last_modified)
+        return response
+
+    def remember_etag(self, response):
+        # Lives as long as the data the response is made of
+        widget = self.widget
+        if widget.fresh_until is None or widget.timed_out:
+            return
+        timeout = widget.fresh_until - time.time()
+        if timeout > 0:
+            last_modified = widget.last_modified and int(widget.last_modified)
+            cache.get_cache().set(self.get_etag_key(),
+                                  (response['ETag'], last_modified), timeout)
+
+    def get_widget(self):
+        pk, slug = self.kwargs['pk'], self.kwargs['slug']
+        try:
+            self.dashboard = self.dashboards[pk]
+        except KeyError:
+            raise Http404(f'Dashboard "{pk}" not found')
+
+        widget = self.dashboard.get_widget(self.request, slug,
+                                           **self.get_widget_options())
+        if widget is None:
+            raise Http404(f'Widget "{slug}" not found')
+        return widget
+
+    def get_widget_options(self):
+        # Options are a part of cache keys, so every page is cached
+        return {name: self.request.GET[name] for name in self.widget_params
+                if self.request.GET.get(name)}
+
+    def render_to_response(self, context, **response_kwargs):
+        # Widget is reported with the conditional response
+        return super(DashboardView, self).render_to_response(
+            context, **response_kwargs)
+
+    def get_context_data(self, **kwargs):
+        # Widget's body only, no admin stuff is required
+        kwargs.update({
+            'dashboard': self.dashboard,
+            'widget': self.widget,
+            'sharp': app_settings.SHARP,
+        })
+        return super(DashboardView, self).get_context_data(**kwargs)
+
+
+class WidgetDataView(WidgetView):
+    def get(self, request, *args, **kwargs):
+        self.widget = self.get_widget()
+        if not hasattr(self.widget, 'get_json_data'):
+            raise Http404(f'Widget "{self.widget.slug}" has no data')
+        response = self.get_not_modified()
+        if response is not None:
+            return response
+
+        dumps = serializers.get_serializer()
+        content = dumps(self.get_json_data())
+        response = conditional_response(
+            request, content, 'application/json',
+            last_modified=self.widget.last_modified)
+        self.remember_etag(response)
+        self.report(response, [self.widget])
+        return response
+
+    def get_json_data(self):
+        # Time series send the points since the browser's last one
+        since = self.request.GET.get('since')
+        get_json_delta = getattr(self.widget, 'get_json_delta', None)
+        if since and get_json_delta is not None:
+            try:
+                return get_json_delta(float(since))
+            except ValueError:
+                pass
+        return self.widget.get_json_data()
+
+
+class StreamView(DashboardView):
+    """
+    Server-Sent Events stream of dashboard's widget updates.
+    """
+
+    def get(self, request, *args, **kwargs):
+        pk = self.kwargs['pk']
+        try:
+            self.dashboard = self.dashboards[pk]
+        except KeyError:
+            raise Http404(f'Dashboard "{pk}" not found')
+        if not can_stream(request):
+            return HttpResponse('Stream requires Django 4.2 under ASGI',
+                                content_type='text/plain', status=501)
+
+        hub = broadcast.get_hub()
+        if ASYNC_STREAMING and isinstance(request, ASGIRequest):
+            # Async subscription requires the loop it's consumed in
+            events = self.astream(hub)
+        else:
+            # Blocks the worker, but at least the subscription is made
+            # before the response is returned
+            events = self.stream(hub.subscribe(self.dashboard.pk))
+
+        response = StreamingHttpResponse(events,
+                                         content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    def stream(self, subscription):
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                event = subscription.get(app_settings.STREAM_HEARTBEAT)
+                if event is None:
+                    # Keeps connection alive and finds out if it's closed
+                    yield ': ping\n\n'
+                else:
+                    yield self.format_event(self.resolve_event(event))
+        finally:
+            subscription.close()
+
+    async def astream(self, hub):
+        subscription = hub.subscribe(self.dashboard.pk, asynchronous=True)
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                event = await subscription.get(app_settings.STREAM_HEARTBEAT)
+                if event is None:
+                    yield ': ping\n\n'
+                else:
+                    event = await sync_to_async(self.resolve_event)(event)
+                    yield self.format_event(event)
+        finally:
+            subscription.close()
+
+    def resolve_event(self, event):
+        # Charts' data is sent with the event, so viewers don't request it
+        if 'data' in event:
+            return event
+
+        widget = self.dashboard.get_widget(self.request, event['widget'])
+        if widget is None or not hasattr(widget, 'get_json_data'):
+            return event
+
+        try:
+            if widget.data_cache_timeout:
+                # Data doesn't depend on anything but the declared
+                # stuff, so it's computed once for all the viewers
+                key = (event.get('id'), widget.get_data_cache_key('json'))
+                data = broadcast.get_hub().once(key, widget.get_json_data)
+            else:
+                data = widget.get_json_data()
+        except Exception:
+            # Viewers will try to fetch it
+            return event
+        return dict(event, data=data)
+
+    def format_event(self, event):
+        data = serializers.get_serializer()(event)
+        return 'id: {}\nevent: widget\ndata: {}\n\n'.format(
+            event.get('id', ''), data)
+
+
+class MetricsView(View):
+    """
+    Widgets' metrics in Prometheus text exposition format.
+    Available to staff users or with the token as a bearer token.
+    """
+    controlcenter = None
+
+    def get(self, request, *args, **kwargs):
+        if not app_settings.METRICS:
+            raise Http404('Metrics are disabled')
+        if not self.has_permission(request):
+            return HttpResponseForbidden()
+        response = HttpResponse(metrics.exposition(),
+                                content_type=metrics.CONTENT_TYPE)
+        patch_cache_control(response, no_cache=True)
+        return response
+
+    def has_permission(self, request):
+        token = app_settings.METRICS_TOKEN
+        authorization = request.META.get('HTTP_AUTHORIZATION', '')
+        if token and constant_time_compare(authorization,
+                                           'Bearer {}'.format(token)):
+            return True
+        user = getattr(request, 'user', None)
+        return bool(user is not None and user.is_active and user.is_staff)
+
+
+controlcenter = ControlCenter('controlcenter', DashboardView, WidgetView,
+                              WidgetDataView, StreamView, MetricsView)
+async_controlcenter = ControlCenter('controlcenter', AsyncDashboardView,
+                                    WidgetView, WidgetDataView, StreamView,
+                                    MetricsView)
@@ -1,13 +1,49 @@
+import datetime
+from collections.abc import Mapping, Sequence
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Count, DateTimeField
+from django.db.models.functions import (
+    TruncDay,
+    TruncHour,
+    TruncMonth,
+    TruncWeek,
+)
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from .. import cache, downsample
 from ..utils import deepmerge
-from .core import Widget, WidgetMeta
+from .core import Widget, WidgetMeta, get_field_path
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:
+    # Python < 3.9, Django 4.0 and 4.1 require the backport,
+    # older ones require pytz
+    try:
+        from backports.zoneinfo import ZoneInfo
+    except ImportError:
+        from pytz import timezone as ZoneInfo
 
 __all__ = ['LineChart', 'TimeSeriesChart', 'BarChart', 'PieChart',
            'SingleLineChart', 'SingleBarChart', 'SinglePieChart',
-           'LINE', 'BAR', 'PIE']
+           'LINE', 'BAR', 'PIE', 'HOUR', 'DAY', 'WEEK', 'MONTH']
 
 # Chart types
 PIE, BAR, LINE = 'Pie', 'Bar', 'Line'
 
+# Time series buckets
+HOUR, DAY, WEEK, MONTH = 'hour', 'day', 'week', 'month'
+
+TRUNCS = {
+    HOUR: TruncHour,
+    DAY: TruncDay,
+    WEEK: TruncWeek,
+    MONTH: TruncMonth,
+}
+
 
 class Chartist(object):
     def __init__(self):
@@ -49,25 +85,206 @@ class ChartMeta(WidgetMeta):
 
 class Chart(Widget, metaclass=ChartMeta):
     template_name = 'chart.html'
+    fetch_data = False
+
+    # Declarative series, pivoted from a single grouped query
+    x_field = None
+    split_field = None
+    aggregate = Count('pk')
+    fill_value = 0
+    # Number of points sent to the browser
+    max_points = None
+    # Time series points are sent as x and y arrays
+    columnar = False
+    # Columnar x are sent as differences
+    delta_x = False
+    # Number of digits floats are rounded to
+    float_precision = None
 
     class Chartist:
         klass = LINE
         scale = 'octave'
 
+    def values(self):
+        if self.x_field is None:
+            return super(Chart, self).values
+
+        fields = [self.x_field]
+        if self.split_field:
+            fields.append(self.split_field)
+        # Reversed data is expected in reversed order
+        if self.chartist.options.get('reverseData'):
+            ordering = ['-' + x for x in fields]
+        else:
+            ordering = fields
+        queryset = (self.get_queryset()
+                    .order_by()
+                    .values(*fields)
+                    .annotate(_value=self.aggregate)
+                    .order_by(*ordering))
+        return list(queryset.values_list(*fields + ['_value']))
+
+    def get_display(self, name, value):
+        # Choices are displayed with their labels
+        fields = get_field_path(self.get_queryset().model, name)
+        if fields and fields[-1].choices:
+            return dict(fields[-1].flatchoices).get(value, value)
+        return value
+
+    @cached_property
+    def pivot(self):
+        """
+        Returns labels, series and legend of the grouped values.
+        Missing values are filled with ``fill_value``.
+        """
+        labels = {}
+        columns = {}
+        for row in self.values:
+            x, value = row[0], row[-1]
+            split = row[1] if self.split_field else None
+            if isinstance(value, Decimal):
+                value = float(value)
+            labels.setdefault(x, None)
+            columns.setdefault(split, {})[x] = value
+
+        splits = sorted(columns, key=lambda x: (x is None, x))
+        series = []
+        for split in splits:
+            column = columns[split]
+            series.append([
+                self.fill_value if column.get(x) is None else column[x]
+                for x in labels])
+
+        legend = []
+        if self.split_field:
+            legend = [self.get_display(self.split_field, x) for x in splits]
+        labels = [self.get_display(self.x_field, x) for x in labels]
+        return labels, series, legend
+
     def legend(self):
         # Legend for chart
+        if self.x_field is not None:
+            return self.pivot[2]
         return []
 
     def labels(self):
         # List of x-axis labels
         # Do not return generator!
+        if self.x_field is not None:
+            return self.pivot[0]
         return []
 
     def series(self):
         # List of y-axis values
         # Do not return generator!
+        if self.x_field is not None:
+            return self.pivot[1]
         return []
 
+    def get_downsampler(self):
+        # Lines keep their shape, bars keep their envelope
+        if self.chartist.klass == LINE:
+            return downsample.lttb
+        elif self.chartist.klass == BAR:
+            return downsample.minmax
+
+    @cached_property
+    def chart_data(self):
+        """
+        Labels and series as they're sent to the browser:
+        downsampled to ``max_points`` and encoded.
+        """
+        labels, series = self.downsample(self.labels, self.series)
+        return {'labels': labels, 'series': self.encode_series(series)}
+
+    def downsample(self, labels, series):
+        downsampler = self.get_downsampler()
+        if not self.max_points or downsampler is None or not series:
+            return labels, series
+
+        # Single charts have got a single flat series
+        flat = not isinstance(series[0], Sequence)
+        if flat:
+            series = [series]
+
+        # Time series points have got their own x,
+        # others share labels so they're kept in sync
+        series = list(series)
+        aligned = [i for i, values in enumerate(series)
+                   if not (values and isinstance(values[0], Mapping))]
+        for i in set(range(len(series))) - set(aligned):
+            points = series[i]
+            indices = downsampler([x['y'] for x in points], self.max_points,
+                                  [x['x'] for x in points])
+            series[i] = [points[x] for x in indices]
+
+        if aligned:
+            # Series split the points, so they're sent with the same
+            # ones and stay aligned within max_points
+            threshold = self.max_points // len(aligned)
+            indices = sorted(set().union(*(
+                downsampler(series[i], threshold) for i in aligned)))
+            for i in aligned:
+                series[i] = [series[i][x] for x in indices
+                             if x < len(series[i])]
+            if not indices or len(labels) > indices[-1]:
+                labels = [labels[x] for x in indices]
+
+        return labels, series[0] if flat else series
+
+    def encode_number(self, value):
+        if isinstance(value, Decimal):
+            value = float(value)
+        if isinstance(value, float):
+            if self.float_precision is not None:
+                value = round(value, self.float_precision)
+            # Saves a couple of bytes on every timestamp
+            if value.is_integer():
+                return int(value)
+        return value
+
+    def encode_series(self, series):
+        """
+        Returns series in the compact form, which is decoded
+        by ``controlcenter.decodeSeries`` in the browser.
+        """
+        if not (self.columnar or self.float_precision is not None):
+            return series
+        if series and not isinstance(series[0], Sequence):
+            return [self.encode_number(x) for x in series]
+        return [self.encode_values(values) for values in series]
+
+    def encode_values(self, values):
+        if not (values and isinstance(values[0], Mapping)):
+            return [self.encode_number(x) for x in values]
+
+        xs = [self.encode_number(point['x']) for point in values]
+        ys = [self.encode_number(point['y']) for point in values]
+        if not self.columnar:
+            return [{'x': x, 'y': y} for x, y in zip(xs, ys)]
+        if not self.delta_x:
+            return {'x': xs, 'y': ys}
+        # Timestamps of buckets are mostly the same small delta
+        deltas = [self.encode_number(b - a) for a, b in zip(xs, xs[1:])]
+        return {'x': xs[:1] + deltas, 'y': ys, 'delta': True}
+
+    def get_refresh_url(self):
+        # Chart is updated with new data, no html required
+        return self.get_data_url()
+
+    def get_chartist_config(self):
+        # Everything Chartist.js is set up with
+        return dict(vars(self.chartist))
+
+    def get_json_data(self):
+        data = self.chart_data
+        return {
+            'labels': data['labels'],
+            'series': data['series'],
+            'legend': self.legend,
+            'chartist': self.get_chartist_config(),
+        }
+
 
 class LineChart(Chart):
     class Chartist:
@@ -94,6 +311,227 @@ class TimeSeriesChart(Chart):
         time_series = True
         timestamp_options = {}
 
+    # Declarative series, computed by the database
+    date_field = None
+    bucket = DAY
+    time_range = None
+    tz = None
+    # Seconds to keep closed buckets for, only the current one is computed
+    closed_buckets_timeout = None
+
+    def get_tzinfo(self):
+        if not settings.USE_TZ:
+            return None
+        if self.tz is None:
+            return timezone.get_current_timezone()
+        if isinstance(self.tz, str):
+            return ZoneInfo(self.tz)
+        return self.tz
+
+    def get_aggregates(self):
+        # Legend labels can't be used as sql aliases
+        aggregate = self.aggregate
+        if not isinstance(aggregate, Mapping):
+            aggregate = {None: aggregate}
+        return [('_series{}'.format(i), label, expression)
+                for i, (label, expression) in enumerate(aggregate.items())]
+
+    def truncate(self, value):
+        """
+        Returns the naive local start of the bucket the value is in,
+        same as the database does.
+        """
+        if not isinstance(value, datetime.datetime):
+            value = datetime.datetime.combine(value, datetime.time())
+        tzinfo = self.get_tzinfo()
+        if tzinfo is not None and timezone.is_aware(value):
+            value = timezone.localtime(value, tzinfo)
+        value = value.replace(minute=0, second=0, microsecond=0,
+                              tzinfo=None)
+        if self.bucket == HOUR:
+            return value
+        value = value.replace(hour=0)
+        if self.bucket == WEEK:
+            value -= datetime.timedelta(days=value.weekday())
+        elif self.bucket == MONTH:
+            value = value.replace(day=1)
+        return value
+
+    def next_bucket(self, value):
+        if self.bucket == HOUR:
+            return value + datetime.timedelta(hours=1)
+        elif self.bucket == DAY:
+            return value + datetime.timedelta(days=1)
+        elif self.bucket == WEEK:
+            return value + datetime.timedelta(weeks=1)
+        year, month = divmod(value.month, 12)
+        return value.replace(year=value.year + year, month=month + 1)
+
+    def timestamp(self, value):
+        # POSIX seconds of the bucket's start
+        if not isinstance(value, datetime.datetime):
+            value = datetime.datetime.combine(value, datetime.time())
+        if timezone.is_naive(value):
+            value = timezone.make_aware(
+                value, self.get_tzinfo() or timezone.get_default_timezone())
+        return value.timestamp()
+
+    def from_timestamp(self, value):
+        # Naive local datetime of POSIX seconds, the way truncate takes it
+        value = datetime.datetime.fromtimestamp(value, datetime.timezone.utc)
+        tzinfo = self.get_tzinfo() or timezone.get_default_timezone()
+        return timezone.localtime(value, tzinfo).replace(tzinfo=None)
+
+    def get_time_range(self):
+        if self.time_range is None:
+            return None, None
+        now = timezone.now()
+        return self.truncate(now - self.time_range), self.truncate(now)
+
+    def values(self):
+        if self.date_field is None:
+            # Series are built by hand
+            return super(TimeSeriesChart, self).values
+
+        start, end = self.get_time_range()
+        if self.closed_buckets_timeout:
+            return self.get_cached_rows(start)
+        return self.get_rows(start)
+
+    def get_rows(self, start=None):
+        """
+        Returns buckets and their aggregates since the naive local start.
+        """
+        queryset = self.get_queryset()
+        # Dates are truncated and compared as they are
+        fields = get_field_path(queryset.model, self.date_field)
+        tzinfo = None
+        if fields and isinstance(fields[-1], DateTimeField):
+            tzinfo = self.get_tzinfo()
+
+        if start is not None:
+            if fields and not isinstance(fields[-1], DateTimeField):
+                start = start.date()
+            elif tzinfo is not None:
+                start = timezone.make_aware(start, tzinfo)
+            queryset = queryset.filter(
+                **{'{}__gte'.format(self.date_field): start})
+
+        # A single GROUP BY query for all the series
+        trunc = TRUNCS[self.bucket](self.date_field, tzinfo=tzinfo)
+        aggregates = self.get_aggregates()
+        queryset = (queryset.order_by()
+                    .annotate(_bucket=trunc)
+                    .values('_bucket')
+                    .annotate(**{alias: expression
+                                 for alias, _, expression in aggregates})
+                    .order_by('_bucket'))
+        return list(queryset.values_list(
+            '_bucket', *(alias for alias, _, _ in aggregates)))
+
+    def get_cached_rows(self, start=None):
+        """
+        Closed buckets don't change, so they're cached and only
+        the ones since the latest cached are computed.
+        """
+        # Buckets are naive local ones, so they're cached per zone
+        key = self.get_data_cache_key('closed_buckets:{}'.format(
+            cache.make_digest(str(self.get_tzinfo()), self.bucket)))
+        entry = cache.get_cache().get(key)
+        since, rows = start, []
+        if entry is not None:
+            closed_until, rows = entry
+            if start is None or closed_until >= start:
+                since = closed_until
+            else:
+                rows = []
+
+        current = self.truncate(timezone.now())
+        current_ts = self.timestamp(current)
+        fresh = self.get_rows(since)
+        closed = rows + [x for x in fresh
+                         if self.timestamp(x[0]) < current_ts]
+        if start is not None:
+            # Old buckets are out of the window
+            start_ts = self.timestamp(start)
+            closed = [x for x in closed if self.timestamp(x[0]) >= start_ts]
+        cache.get_cache().set(key, (current, closed),
+                              self.closed_buckets_timeout)
+        return closed + [x for x in fresh
+                         if self.timestamp(x[0]) >= current_ts]
+
+    def get_buckets(self, rows=None, since=None):
+        """
+        Returns timestamps of all the buckets of the time range,
+        or the rows' one if it's not set, from the since bucket on.
+        """
+        if rows is None:
+            rows = self.values
+        start, end = self.get_time_range()
+        if start is None:
+            if not rows:
+                return []
+            start = self.truncate(rows[0][0])
+            end = self.truncate(rows[-1][0])
+        if since is not None and since > start:
+            start = since
+
+        buckets = []
+        while start <= end:
+            buckets.append(self.timestamp(start))
+            start = self.next_bucket(start)
+        return buckets
+
+    def series(self):
+        if self.date_field is None:
+            return []
+        return self.make_series(self.values, self.get_buckets())
+
+    def make_series(self, rows, buckets):
+        # Empty buckets are filled with zeros in a single pass,
+        # buckets the database has got are never lost
+        empty = (0,) * len(self.get_aggregates())
+        points = dict.fromkeys(buckets, empty)
+        for row in rows:
+            points[self.timestamp(row[0])] = tuple(
+                float(x) if isinstance(x, Decimal) else x or 0
+                for x in row[1:])
+
+        timestamps = sorted(points)
+        return [[{'x': x, 'y': points[x][i]} for x in timestamps]
+                for i in range(len(empty))]
+
+    def legend(self):
+        if self.date_field is None or not isinstance(self.aggregate,
+                                                     Mapping):
+            return []
+        return list(self.aggregate)
+
+    def get_json_delta(self, since):
+        """
+        Returns points since the timestamp, which the browser
+        merges with the ones it's got, and the window's start.
+        """
+        start, end = self.get_time_range()
+        if self.date_field is None or self.data_cache_timeout:
+            # Cached series are cheaper than a query
+            series = self.series
+        else:
+            # Only the buckets since the browser's last one are queried
+            bucket = self.truncate(self.from_timestamp(since))
+            if start is not None and start > bucket:
+                bucket = start
+            rows = self.get_rows(bucket)
+            series = self.make_series(rows, self.get_buckets(rows, bucket))
+        series = [[point for point in values if point['x'] >= since]
+                  for values in series]
+        return {
+            'series': self.encode_series(series),
+            'legend': self.legend,
+            'since': since,
+            'start': None if start is None else self.timestamp(start),
+        }
+
 
 class BarChart(Chart):
     class Chartist:
@@ -1,17 +1,58 @@
-from collections.abc import Sequence
+from collections.abc import Mapping, Sequence
+import base64
+import binascii
+import contextlib
+import datetime
+import functools
 import itertools
+import json
+import logging
 import os
+import time
 from abc import ABCMeta
+from urllib.parse import quote
 
-from django.core.exceptions import ImproperlyConfigured
+from django.conf import settings
+from django.core.exceptions import (
+    FieldDoesNotExist,
+    ImproperlyConfigured,
+    ValidationError,
+)
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DEFAULT_DB_ALIAS, connections, models, router
+from django.db.models import F, Q
+from django.db.models.query import ModelIterable, QuerySet
+from django.urls import NoReverseMatch, reverse
 from django.utils.functional import cached_property
+from django.utils.html import conditional_escape, mark_safe
+from django.utils.http import RFC3986_SUBDELIMS, urlencode
+from django.utils.translation import get_language
 
+from .. import app_settings, broadcast, cache, metrics
 from ..base import BaseModel
+from ..concurrency import run_in_background
+from ..utils import count_queries, indexonly
+
+try:
+    from asgiref.sync import async_to_sync, sync_to_async
+except ImportError:
+    # Django < 3.0, async methods are not supported
+    async_to_sync = sync_to_async = None
+
+try:
+    from asgiref.sync import iscoroutinefunction
+except ImportError:
+    from asyncio import iscoroutinefunction
 
 __all__ = ['Group', 'ItemList', 'Widget', 'SMALL', 'MEDIUM', 'LARGE',
            'LARGER', 'LARGEST', 'FULL']
 
 
+_missing = object()
+
+logger = logging.getLogger('controlcenter')
+
+
 # Actually we don't need all that sizes
 # but should have a grid for Masonry
 # so I'm going to leave the most helpful ones
@@ -24,6 +65,35 @@ LARGEST = 5  # 75%  or  [      x      ] + [x]
 FULL = 6     # 100% or  [         x         ]
 
 
+def _async_unsupported(widget):
+    raise ImproperlyConfigured(
+        'Async data methods require Django 3.0 or newer')
+
+
+def evaluated(attr, func):
+    # Templates are sync, so async methods are run to completion,
+    # on the server's loop if there is one
+    is_async = iscoroutinefunction(func)
+    if not is_async:
+        call = func
+    elif async_to_sync is not None:
+        call = async_to_sync(func)
+    else:
+        call = _async_unsupported
+
+    # Lets the widget decide how to get the value, e.g. from cache
+    @functools.wraps(func)
+    def wrapper(self):
+        evaluate = getattr(self, 'evaluate_attr', None)
+        if evaluate is None:
+            return call(self)
+        return evaluate(attr, call)
+
+    # Awaited by async evaluation as it is
+    wrapper.async_func = func if is_async else None
+    return wrapper
+
+
 class WidgetMeta(ABCMeta):
     # Makes certain methods cached
     CACHED_ATTRS = (
@@ -36,7 +106,7 @@ class WidgetMeta(ABCMeta):
         # cached_property fires on property's __get__
         for attr in mcs.CACHED_ATTRS:
             if attr in attrs:
-                attrs[attr] = cached_property(attrs[attr])
+                attrs[attr] = cached_property(evaluated(attr, attrs[attr]))
         return super(WidgetMeta, mcs).__new__(mcs, name, bases, attrs)
 
 
@@ -46,16 +116,324 @@ class BaseWidget(BaseModel, metaclass=WidgetMeta):
     queryset = None
     changelist_url = None
     cache_timeout = None
+    cache_vary = ()
+    data_cache_timeout = None
+    data_cache_stale_timeout = None
+    data_cache_vary = ()
+    data_cache_version = 1
+    refresh_cache = False
     template_name = None
     template_name_prefix = None
     limit_to = None
     width = None
     height = None
+    refresh_interval = None
+    max_queries = None
+    max_time_ms = None
+    budget_defer_timeout = None
+    timeout = None
+    use_statement_timeout = False
+    dashboard = None
 
     def __init__(self, request, **options):
         super(BaseWidget, self).__init__()
         self.request = request
         self.init_options = options
+        # Seconds spent on evaluation of cached attributes
+        self.timings = {}
+        # Attributes being evaluated, e.g. when super() is called
+        self._evaluating = set()
+        # Timestamp of the latest cached value computation
+        self.last_modified = None
+        # Timestamp the cached values used are fresh till
+        self.fresh_until = None
+        # Spent on cached attributes altogether
+        self.queries = 0
+        self.sql_time = 0.0
+        self.evaluation_time = 0.0
+        self.over_budget = False
+        # Set if evaluation has taken longer than the timeout
+        self.timed_out = False
+        # Data cache lookups of cached attributes
+        self.data_cache_hits = 0
+        self.data_cache_misses = 0
+        # Seconds spent on the template, see {% timed %} tag
+        self.render_time = 0.0
+        self.renders = 0
+
+    @classmethod
+    def get_cache_name(cls):
+        return '{}.{}'.format(cls.__module__, cls.__qualname__)
+
+    @classmethod
+    def invalidate_cache(cls):
+        # Makes every cache key of the widget stale
+        # and lets dashboard viewers know about that
+        cache.bump_generation(cls.get_cache_name())
+        broadcast.notify_changed(cls)
+
+    def get_refresh_url(self):
+        # Polled by the browser to update the widget
+        return self.get_absolute_url()
+
+    def get_cache_alias(self):
+        return app_settings.CACHE_ALIAS
+
+    def get_cache_key(self):
+        # Body's cache key, widget's html depends on all of that
+        name = self.get_cache_name()
+        digest = cache.make_digest(
+            getattr(self.dashboard, 'pk', None),
+            sorted(self.init_options.items()),
+            get_language(),
+            cache.vary_on(self, self.cache_vary))
+        return cache.make_key('fragment', name, cache.get_generation(name),
+                              digest)
+
+    def get_data_cache_key(self, attr):
+        name = self.get_cache_name()
+        # Labels and such might be translated
+        digest = cache.make_digest(
+            sorted(self.init_options.items()),
+            get_language(),
+            cache.vary_on(self, self.data_cache_vary))
+        return cache.make_key('data', name, self.data_cache_version,
+                              cache.get_generation(name), digest, attr)
+
+    def evaluate_attr(self, attr, func):
+        # Parent's methods called with super() share the key,
+        # so only the very first call goes to cache
+        if attr in self._evaluating:
+            return func(self)
+
+        # Attributes used by other ones are measured by them
+        outermost = not self._evaluating
+        self._evaluating.add(attr)
+        try:
+            if not outermost:
+                return self._evaluate(attr, func)
+            with self.measure():
+                value = self._evaluate(attr, func)
+                if isinstance(value, QuerySet):
+                    # Lazy querysets would be run by the template,
+                    # out of the budget
+                    len(value)
+                return value
+        finally:
+            self._evaluating.discard(attr)
+
+    def _evaluate(self, attr, func):
+        if not self.data_cache_timeout:
+            return func(self)
+        return self._evaluate_cached(attr, func)
+
+    async def aevaluate_attr(self, attr, func):
+        """
+        Async counterpart of ``evaluate_attr``: the coroutine is awaited
+        on the running loop, only the data cache is accessed on a thread.
+        """
+        if self.data_cache_timeout:
+            value = await sync_to_async(self._get_cached)(attr)
+            if value is not _missing:
+                return value
+
+        started = time.perf_counter()
+        try:
+            value = await func(self)
+        finally:
+            # Async queries are made on other threads, so they
+            # can't be counted, the time is known though
+            self.record_evaluation(0, 0.0, time.perf_counter() - started)
+
+        if self.data_cache_timeout:
+            await sync_to_async(self._set_cached)(attr, value)
+        return value
+
+    @contextlib.contextmanager
+    def measure(self):
+        started = time.perf_counter()
+        try:
+            with count_queries() as counter:
+                yield
+        finally:
+            self.record_evaluation(counter.count, counter.time,
+                                   time.perf_counter() - started)
+
+    def record_evaluation(self, queries, sql_time, duration):
+        self.queries += queries
+        self.sql_time += sql_time
+        self.evaluation_time += duration
+        metrics.record(self.get_cache_name(), queries, sql_time, duration)
+        self.check_budget()
+
+    def check_budget(self):
+        if self.over_budget:
+            return
+        time_ms = self.evaluation_time * 1000
+        if not (self.max_queries is not None and
+                self.queries > self.max_queries or
+                self.max_time_ms is not None and
+                time_ms > self.max_time_ms):
+            return
+
+        self.over_budget = True
+        name = self.get_cache_name()
+        metrics.record_breach(name)
+        logger.warning(
+            '%s is over budget: %d queries, %.1fms (%.1fms in database)',
+            name, self.queries, time_ms, self.sql_time * 1000)
+        if self.budget_defer_timeout:
+            cache.get_cache().set(cache.make_key('over_budget', name), 1,
+                                  self.budget_defer_timeout)
+
+    def get_db_alias(self):
+        if self.model is None:
+            return DEFAULT_DB_ALIAS
+        return router.db_for_read(self.model)
+
+    @contextlib.contextmanager
+    def limit_statements(self):
+        """
+        Makes PostgreSQL cancel the widget's queries which take longer
+        than its timeout, so hung widgets don't hold connections.
+        """
+        connection = connections[self.get_db_alias()]
+        if not (self.timeout and self.use_statement_timeout and
+                connection.vendor == 'postgresql'):
+            yield
+            return
+
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT current_setting('statement_timeout')")
+            previous = cursor.fetchone()[0]
+            cursor.execute("SELECT set_config('statement_timeout', %s, false)",
+                           [str(int(self.timeout * 1000))])
+        try:
+            yield
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT set_config('statement_timeout', %s, false)",
+                    [previous])
+
+    def is_deferred(self):
+        """
+        Widgets that have been over budget recently are loaded
+        separately, so they don't hold the whole dashboard.
+        """
+        if not self.budget_defer_timeout or self.dashboard is None:
+            return False
+        key = cache.make_key('over_budget', self.get_cache_name())
+        return bool(cache.get_cache().get(key))
+
+    def get_profile(self):
+        """
+        Returns what the widget has cost the current request,
+        times are in milliseconds.
+        """
+        data_cache = None
+        if self.data_cache_hits and self.data_cache_misses:
+            data_cache = 'partial'
+        elif self.data_cache_hits:
+            data_cache = 'hit'
+        elif self.data_cache_misses:
+            data_cache = 'miss'
+
+        body_cache = None
+        if self.cache_timeout and not self.timed_out:
+            # Cached body's template is not rendered at all
+            body_cache = 'miss' if self.renders else 'hit'
+
+        return {
+            'queries': self.queries,
+            'sql_time': self.sql_time * 1000,
+            'data_time': self.evaluation_time * 1000,
+            'render_time': self.render_time * 1000,
+            'data_cache': data_cache,
+            'body_cache': body_cache,
+            'timed_out': self.timed_out,
+        }
+
+    def _evaluate_cached(self, attr, func):
+        value = self._get_cached(attr)
+        if value is _missing:
+            value = func(self)
+            self._set_cached(attr, value)
+        return value
+
+    def _get_cached(self, attr):
+        # Returns _missing if the value has to be computed
+        key = self.get_data_cache_key(attr)
+        entry = None if self.refresh_cache else cache.get_cache().get(key)
+        if entry is not None:
+            value, computed_at = entry
+            self._set_modified(computed_at)
+            self._set_fresh_until(computed_at + self.data_cache_timeout)
+            if time.time() - computed_at < self.data_cache_timeout:
+                self.data_cache_hits += 1
+                return value
+
+            if self.data_cache_stale_timeout:
+                # It's stale but still alive, so it's served
+                # while a single worker computes a new one
+                lock = key + ':lock'
+                if cache.get_cache().add(lock, 1,
+                                         self.data_cache_stale_timeout):
+                    run_in_background(self.revalidate_attr, attr, lock)
+                self.data_cache_hits += 1
+                return value
+
+        self.data_cache_misses += 1
+        return _missing
+
+    def _set_cached(self, attr, value):
+        # Value is stored with computation time to tell if it's fresh,
+        # stale entries live until the hard timeout
+        computed_at = time.time()
+        self._set_modified(computed_at)
+        self._set_fresh_until(computed_at + self.data_cache_timeout)
+        timeout = (self.data_cache_timeout +
+                   (self.data_cache_stale_timeout or 0))
+        cache.get_cache().set(self.get_data_cache_key(attr),
+                              (value, computed_at), timeout)
+
+    def _set_modified(self, computed_at):
+        if self.last_modified is None or computed_at > self.last_modified:
+            self.last_modified = computed_at
+
+    def _set_fresh_until(self, fresh_until):
+        if self.fresh_until is None or fresh_until < self.fresh_until:
+            self.fresh_until = fresh_until
+
+    def revalidate_attr(self, attr, lock=None):
+        # A new widget is used, because this one has got stale values
+        # which the attribute might depend on
+        widget = self.clone()
+        widget.refresh_cache = True
+        try:
+            return getattr(widget, attr)
+        finally:
+            if lock:
+                cache.get_cache().delete(lock)
+
+    def clone(self):
+        widget = type(self)(self.request, **self.init_options)
+        widget.dashboard = self.dashboard
+        return widget
+
+    def get_absolute_url(self):
+        # Widget's fragment url, available for dashboard widgets only
+        if self.dashboard is None:
+            return
+        return reverse('controlcenter:widget',
+                       kwargs={'pk': self.dashboard.pk, 'slug': self.slug})
+
+    def get_data_url(self):
+        # Widget's json data url
+        if self.dashboard is None:
+            return
+        return reverse('controlcenter:widget_data',
+                       kwargs={'pk': self.dashboard.pk, 'slug': self.slug})
 
     def get_template_name(self):
         assert self.template_name, (
@@ -142,9 +520,586 @@ class Widget(BaseWidget):
     template_name_prefix = 'controlcenter/widgets'
 
 
+def _method_prop(obj, attrname, attrprop):
+    """
+    Returns property of callable object's attribute.
+    """
+    attr = getattr(obj, attrname, None)
+    if attr and callable(attr):
+        return getattr(attr, attrprop, None)
+
+
+_method_label = functools.partial(_method_prop, attrprop='short_description')
+
+
+def get_field_path(model, name):
+    """
+    Returns fields of ``author__name``-like lookup, or None
+    if it's not a lookup of model fields.
+    """
+    fields = []
+    for part in name.split('__'):
+        if model is None:
+            return
+        try:
+            if part == 'pk':
+                field = model._meta.pk
+            else:
+                field = model._meta.get_field(part)
+        except FieldDoesNotExist:
+            return
+        fields.append(field)
+        model = field.related_model if field.is_relation else None
+    return fields
+
+
+def is_nullable(model, name):
+    # Unknown fields, e.g. annotations, might be NULL as well
+    fields = get_field_path(model, name)
+    return fields is None or any(x.null for x in fields)
+
+
+def lookup_attr(obj, name):
+    # Follows relations of ``author__name``-like names
+    attr = getattr(obj, name, _missing)
+    if attr is _missing and '__' in name:
+        attr = obj
+        for part in name.split('__'):
+            attr = getattr(attr, part, None)
+            if attr is None:
+                break
+    return None if attr is _missing else attr
+
+
+class Column(object):
+    """
+    ItemList's column. Everything that doesn't depend on the row
+    is resolved once, so rendering a cell costs O(1).
+    """
+
+    # Server side sorting
+    sort_url = None
+    sorted = None
+
+    def __init__(self, widget, attrname, index=None, is_link=False):
+        self.widget = widget
+        self.attrname = attrname
+        # Position in index-only rows
+        self.index = index
+        self.is_link = is_link
+        self.is_sharp = attrname == app_settings.SHARP
+        self.widget_attr = getattr(widget, attrname, None)
+        self.method = (self.widget_attr if self.widget_attr and
+                       callable(self.widget_attr) else None)
+
+    def __repr__(self):
+        return '<Column: {}>'.format(self.attrname)
+
+    @cached_property
+    def label(self):
+        widget, attrname = self.widget, self.attrname
+        widget_prop = _method_label(widget, attrname)
+        if widget_prop is not None:
+            return widget_prop
+
+        elif widget.model:
+            model_prop = _method_label(widget.model, attrname)
+            if model_prop is not None:
+                # Allows to have empty description
+                return model_prop
+
+            # The last one for relations, like in admin
+            fields = get_field_path(widget.model, attrname)
+            if fields:
+                return fields[-1].verbose_name
+        return attrname
+
+    def render(self, obj):
+        """
+        Looks for an attribute value in widget.
+        Then tries to get one from object (dict, sequence, model,
+        namedtuple, whatever looks alike).
+        """
+        attr = self.widget_attr
+        if self.method is not None:
+            value = self.method(obj)
+        elif isinstance(obj, Mapping):
+            # Manager.values()
+            value = obj.get(self.attrname)
+        elif indexonly(obj):
+            try:
+                # Obj might be shorter
+                value = None if self.index is None else obj[self.index]
+            except IndexError:
+                value = None
+        else:
+            # Model, namedtuple, custom stuff
+            attr = lookup_attr(obj, self.attrname)
+            value = attr() if callable(attr) else attr
+
+        if value is None:
+            # It's not found or the value is None
+            return ''
+        elif attr and getattr(attr, 'allow_tags', False):
+            return mark_safe(value)
+        else:
+            return conditional_escape(value)
+
+
+class ChangeUrls(object):
+    """
+    Builds admin change urls of ItemList's rows. The url is reversed
+    once per model, every row's url is formatted from it.
+    """
+
+    # Reversed in place of pk to find out where it goes
+    sentinel = 'controlcenter-pk-sentinel'
+
+    def __init__(self, widget):
+        self.widget = widget
+        self.templates = {}
+
+        # Index-only rows are zipped with list_display,
+        # so the last key wins
+        list_display = getattr(widget, 'list_display', None)
+        names = [x for x in list_display or () if x != app_settings.SHARP]
+        self.pk_indexes = [i for i in reversed(range(len(names)))
+                           if names[i] == 'pk']
+        self.id_indexes = [i for i in reversed(range(len(names)))
+                           if names[i] == 'id']
+
+    def __call__(self, obj):
+        widget = self.widget
+        if not widget.model and not isinstance(obj, models.Model):
+            # No chance to get model url
+            return
+
+        elif isinstance(obj, Mapping):
+            pk = obj.get('pk', obj.get('id'))
+            meta = widget.model._meta
+
+        elif indexonly(obj):
+            if not getattr(widget, 'list_display', None):
+                # No chance to guess pk
+                return
+            pk = self.get_index_pk(obj)
+            meta = widget.model._meta
+
+        else:
+            pk = getattr(obj, 'pk', getattr(obj, 'id', None))
+            if not isinstance(obj, models.Model):
+                # Namedtuples and custom stuff
+                meta = widget.model._meta
+            elif getattr(obj, '_deferred', False):  # pragma: no cover
+                # Deferred model
+                meta = obj._meta.proxy_for_model._meta
+            else:
+                # Regular model or django 1.10 deferred
+                meta = obj._meta
+
+        if pk is None:
+            # No chance to get item url
+            return
+        return self.get_url(meta, pk)
+
+    def get_index_pk(self, obj):
+        for indexes in (self.pk_indexes, self.id_indexes):
+            for index in indexes:
+                # Obj might be shorter
+                if index < len(obj):
+                    return obj[index]
+
+    def get_url_name(self, meta):
+        return 'admin:{}_{}_change'.format(meta.app_label, meta.model_name)
+
+    def get_template(self, meta):
+        try:
+            url = reverse(self.get_url_name(meta), args=[self.sentinel])
+        except NoReverseMatch:
+            return
+        prefix, found, suffix = url.partition(self.sentinel)
+        if found and self.sentinel not in suffix:
+            return prefix, suffix
+
+    def get_url(self, meta, pk):
+        template = self.templates.get(meta, _missing)
+        if template is _missing:
+            template = self.templates[meta] = self.get_template(meta)
+
+        text = str(pk)
+        if template and text:
+            # The same quoting reverse does
+            prefix, suffix = template
+            return prefix + quote(text, RFC3986_SUBDELIMS + '/~:@') + suffix
+
+        # Url pattern doesn't take anything, or it's not registered
+        try:
+            return reverse(self.get_url_name(meta), args=[pk])
+        except NoReverseMatch:
+            return
+
+
+class Page(list):
+    """
+    Rows of the page, pickles with the cursor of the next one.
+    """
+    next_cursor = None
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    # Keys are compared with the rows, so microseconds can't be dropped
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        return super(CursorEncoder, self).default(o)
+
+
+def encode_cursor(data):
+    data = json.dumps(data, cls=CursorEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    # Cursors come from the client, so they are validated by the caller
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, TypeError, UnicodeError, binascii.Error):
+        return
+    return data if isinstance(data, dict) else None
+
+
+class Row(object):
+    def __init__(self, obj, columns, url=None):
+        self.obj = obj
+        self.url = url
+        # Sharp is rendered by the template
+        self.cells = [(column, None if column.is_sharp else column.render(obj))
+                      for column in columns]
+
+
 class ItemList(Widget):
     list_display = None
     list_display_links = None
     template_name = 'itemlist.html'
     empty_message = 'No items to display'
     sortable = False
+    paginate_by = None
+    # Keyset pagination fields, the last one must be unique
+    paginate_ordering = None
+    # Columns sorted by the database, a list or a dict of ordering fields
+    sort_fields = None
+    # None infers relations from list_display, True follows them all
+    list_select_related = None
+    list_prefetch_related = ()
+    # Loads list_display fields only
+    list_only = False
+
+    def values(self):
+        ordering = self.get_sort_ordering()
+        queryset = self.optimize_queryset(self.get_queryset())
+        if ordering:
+            queryset = queryset.order_by(*ordering)
+        if self.paginate_by:
+            return self.paginate(queryset, ordering or self.paginate_ordering)
+        if self.limit_to:
+            return queryset[:self.limit_to]
+        return queryset
+
+    def optimize_queryset(self, queryset):
+        """
+        Makes the queryset fetch everything list_display needs at once.
+        """
+        if (not isinstance(queryset, QuerySet) or
+                queryset._iterable_class is not ModelIterable):
+            # Values and value lists have got it all
+            return queryset
+
+        select_related = self.get_select_related(queryset.model)
+        if select_related is True:
+            queryset = queryset.select_related()
+        elif select_related:
+            queryset = queryset.select_related(*select_related)
+
+        if self.list_prefetch_related:
+            queryset = queryset.prefetch_related(*self.list_prefetch_related)
+
+        # Loaded fields might have been chosen already
+        fields = self.list_only and self.get_only_fields(queryset.model)
+        if fields and queryset.query.deferred_loading == (frozenset(), True):
+            queryset = queryset.only(*fields)
+        return queryset
+
+    def get_list_fields(self, model):
+        # Field paths of columns, None for methods and such
+        return {name: None if callable(getattr(self, name, None))
+                else get_field_path(model, name)
+                for name in self.list_display or ()
+                if name != app_settings.SHARP}
+
+    def get_select_related(self, model):
+        if self.list_select_related is not None:
+            return self.list_select_related
+
+        related = set()
+        for fields in self.get_list_fields(model).values():
+            path = []
+            for field in fields or ():
+                # Many to many, reverse and generic relations can't be
+                # selected, they are up to list_prefetch_related
+                if not (field.one_to_one or
+                        field.many_to_one and field.concrete):
+                    break
+                path.append(field.name)
+                related.add('__'.join(path))
+        return sorted(related)
+
+    def get_only_fields(self, model):
+        """
+        Returns fields to load, or None if some columns
+        can't be mapped to fields.
+        """
+        names = {'pk'}
+        for name, fields in self.get_list_fields(model).items():
+            if not fields or any(x.many_to_many or x.one_to_many
+                                 for x in fields):
+                return
+            names.add(name)
+            # Relations of followed fields
+            for index in range(1, len(fields)):
+                names.add('__'.join(x.name for x in fields[:index]))
+        # Selected relations can't be deferred
+        select_related = self.get_select_related(model)
+        if select_related and select_related is not True:
+            for name in select_related:
+                path = name.split('__')
+                for index in range(1, len(path) + 1):
+                    names.add('__'.join(path[:index]))
+        # Rows' keys for pagination
+        ordering = self.get_sort_ordering() or self.paginate_ordering or ()
+        for name in ordering:
+            name = name.lstrip('-')
+            if '__' not in name and get_field_path(model, name):
+                names.add(name)
+        return sorted(names)
+
+    @property
+    def cursor(self):
+        # Passed by the widget view
+        return self.init_options.get('cursor')
+
+    def get_sort_fields(self):
+        # Column name to ordering field
+        if isinstance(self.sort_fields, Mapping):
+            return dict(self.sort_fields)
+        return {name: name for name in self.sort_fields or ()}
+
+    def get_sort(self):
+        """
+        Returns sorted column name and if it's descending,
+        whitelisted columns only.
+        """
+        value = self.init_options.get('o') or ''
+        name = value.lstrip('-')
+        if name and name in self.get_sort_fields():
+            return name, value.startswith('-')
+
+    def get_sort_ordering(self):
+        sort = self.get_sort()
+        if sort is None:
+            return
+        name, descending = sort
+        prefix = '-' if descending else ''
+        # Pk makes the order stable, so pages don't overlap
+        return prefix + self.get_sort_fields()[name], prefix + 'pk'
+
+    def paginate(self, queryset, ordering=None):
+        """
+        Returns a page of the queryset after the cursor. Seeks with
+        ordering fields if they are given, uses offset otherwise,
+        so a deep page costs the same as the first one.
+        """
+        if ordering:
+            queryset = queryset.order_by(
+                *self.get_keyset_ordering(queryset.model, ordering))
+
+        cursor = self.cursor and decode_cursor(self.cursor) or {}
+        offset, key, rows = 0, cursor.get('key'), None
+        # The extra one tells if there is a next page
+        limit = self.paginate_by + 1
+        if ordering and isinstance(key, list) and len(key) == len(ordering):
+            try:
+                rows = list(queryset.filter(self.get_keyset_filter(
+                    ordering, key, queryset.model))[:limit])
+            except (TypeError, ValueError, OverflowError, ValidationError):
+                # Values don't fit the fields, the cursor has been
+                # tampered with, so it's the first page
+                pass
+        else:
+            offset = cursor.get('offset')
+            if not isinstance(offset, int) or offset < 0:
+                offset = 0
+
+        if rows is None:
+            rows = list(queryset[offset:offset + limit])
+        page = Page(rows[:self.paginate_by])
+        if len(rows) > self.paginate_by:
+            key = ordering and self.get_row_key(ordering, page[-1])
+            if key is not None:
+                page.next_cursor = encode_cursor({'key': key})
+            else:
+                offset += self.paginate_by
+                page.next_cursor = encode_cursor({'offset': offset})
+        return page
+
+    def get_keyset_ordering(self, model, ordering):
+        """
+        Returns ordering with NULLs as the greatest values, which is
+        PostgreSQL's default, so its indexes are still used.
+        """
+        result = []
+        for field in ordering:
+            name = field.lstrip('-')
+            if not is_nullable(model, name):
+                result.append(field)
+            elif field.startswith('-'):
+                result.append(F(name).desc(nulls_first=True))
+            else:
+                result.append(F(name).asc(nulls_last=True))
+        return result
+
+    def get_keyset_filter(self, ordering, key, model=None):
+        # (a, b) > (x, y) is a > x or a = x and b > y,
+        # with the comparison flipped for descending fields
+        condition = None
+        for index, field in enumerate(ordering):
+            q = self.get_keyset_after(field, key[index], model)
+            if q is None:
+                continue
+            for prev, value in zip(ordering[:index], key):
+                name = prev.lstrip('-')
+                q &= (Q(**{name + '__isnull': True}) if value is None
+                      else Q(**{name: value}))
+            condition = q if condition is None else condition | q
+        # Nothing is after the greatest key
+        return Q(pk__in=[]) if condition is None else condition
+
+    def get_keyset_after(self, field, value, model=None):
+        """
+        Returns the lookup of the field's values after the given one,
+        or None if there are none. NULLs are the greatest values.
+        """
+        name = field.lstrip('-')
+        descending = field.startswith('-')
+        if value is None:
+            return Q(**{name + '__isnull': False}) if descending else None
+
+        q = Q(**{'{}__{}'.format(name, 'lt' if descending else 'gt'): value})
+        if not descending and is_nullable(model, name):
+            q |= Q(**{name + '__isnull': True})
+        return q
+
+    def get_row_key(self, ordering, obj):
+        """
+        Returns values of ordering fields of the row, or None
+        if it doesn't have them all.
+        """
+        names = [x for x in self.list_display or ()
+                 if x != app_settings.SHARP]
+        key = []
+        for field in ordering:
+            name = field.lstrip('-')
+            if isinstance(obj, Mapping):
+                value = obj.get(name, _missing)
+            elif indexonly(obj):
+                index = names.index(name) if name in names else len(obj)
+                value = obj[index] if index < len(obj) else _missing
+            else:
+                value = getattr(obj, name, _missing)
+
+            if value is _missing:
+                return
+            if isinstance(value, models.Model):
+                value = value.pk
+            key.append(value)
+        return key
+
+    def get_page_url(self, cursor=None, sort=_missing):
+        # Sort is kept while paging, cursor is dropped while sorting
+        url = self.get_absolute_url()
+        if sort is _missing:
+            sort = self.init_options.get('o')
+        params = [(k, v) for k, v in (('o', sort), ('cursor', cursor)) if v]
+        if url and params:
+            url += '?' + urlencode(params)
+        return url
+
+    def get_next_page_url(self):
+        cursor = getattr(self.values, 'next_cursor', None)
+        if cursor:
+            return self.get_page_url(cursor)
+
+    def get_first_page_url(self):
+        if self.cursor:
+            return self.get_page_url()
+
+    def get_columns(self):
+        list_display = list(self.list_display or ())
+        links = self.list_display_links
+
+        # Index-only rows don't have sharp
+        indexes = {}
+        names = (x for x in list_display if x != app_settings.SHARP)
+        for index, attrname in enumerate(names):
+            indexes.setdefault(attrname, index)
+
+        columns = [Column(self, attrname, indexes.get(attrname),
+                          attrname in links if links else position == 0)
+                   for position, attrname in enumerate(list_display)]
+
+        sort_fields = self.get_sort_fields()
+        sort = self.get_sort()
+        for column in columns:
+            if column.attrname not in sort_fields:
+                continue
+            # Sorted column toggles the direction
+            if sort and sort[0] == column.attrname:
+                column.sorted = 'desc' if sort[1] else 'asc'
+            prefix = '-' if column.sorted == 'asc' else ''
+            column.sort_url = self.get_page_url(
+                sort=prefix + column.attrname)
+        return columns
+
+    @cached_property
+    def columns(self):
+        # Column plan, built once per widget
+        return self.get_columns()
+
+    @cached_property
+    def change_urls(self):
+        return ChangeUrls(self)
+
+    def get_change_url(self, obj):
+        return self.change_urls(obj)
+
+    def get_rows(self):
+        return [Row(obj, self.columns, self.get_change_url(obj))
+                for obj in self.values]
+
+    @cached_property
+    def rows(self):
+        if not settings.DEBUG:
+            return self.get_rows()
+
+        # Rows are expected to be fetched already,
+        # every query made for them is an extra one
+        values = self.values
+        if isinstance(values, QuerySet):
+            len(values)
+        with count_queries() as counter:
+            rows = self.get_rows()
+        if len(rows) > 1 and counter.count >= len(rows):
+            logger.warning(
+                '%s made %d queries rendering %d rows, consider '
+                'list_select_related or list_prefetch_related',
+                self, counter.count, len(rows))
+        return rows
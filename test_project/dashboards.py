@@ -18,3 +18,38 @@ class NonEmptyDashboard(Dashboard):
         MyWidget0,
         widgets.Group([MyWidget1])
     ]
+
+
+class MyCachedWidget(widgets.Widget):
+    template_name = 'chart.html'
+    data_cache_timeout = 60
+
+    def values(self):
+        return [self.request.user.username]
+
+
+class CachedDashboard(Dashboard):
+    widgets = [
+        MyCachedWidget,
+        MyWidget0,
+    ]
+
+
+class MyChart(widgets.LineChart):
+    data_cache_timeout = 60
+
+    def labels(self):
+        return ['a', 'b']
+
+    def series(self):
+        return [[1, 2]]
+
+    def legend(self):
+        return ['Numbers']
+
+
+class ChartDashboard(Dashboard):
+    widgets = [
+        MyChart,
+        MyWidget0,
+    ]
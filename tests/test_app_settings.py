@@ -14,6 +14,18 @@ class AppConfTest(TestCase):
         self.assertEqual(app_settings.DASHBOARDS, [])
         self.assertEqual(app_settings.CHARTIST_COLORS, 'default')
         self.assertEqual(app_settings.SHARP, '#')
+        self.assertFalse(app_settings.CONCURRENT_WIDGETS)
+        self.assertEqual(app_settings.MAX_WORKERS, 4)
+        self.assertFalse(app_settings.DEFERRED_WIDGETS)
+        self.assertEqual(app_settings.CACHE_ALIAS, 'default')
+        self.assertEqual(app_settings.CACHE_KEY_PREFIX, 'controlcenter')
+        self.assertFalse(app_settings.PUSH_UPDATES)
+        self.assertEqual(app_settings.BROADCAST_HUB,
+                         'controlcenter.broadcast.LocalHub')
+        self.assertEqual(app_settings.STREAM_HEARTBEAT, 15)
+        self.assertTrue(app_settings.SERVER_TIMING)
+        self.assertFalse(app_settings.METRICS)
+        self.assertIsNone(app_settings.METRICS_TOKEN)
 
     @override_settings(
         CONTROLCENTER_CHARTIST_COLORS='google',
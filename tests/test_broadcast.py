@@ -0,0 +1,181 @@
+import asyncio
+import json
+import threading
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.handlers.wsgi import WSGIRequest
+from django.test.utils import override_settings
+
+from controlcenter import broadcast
+from controlcenter.broadcast import LocalHub, get_hub
+
+from . import TestCase
+
+try:
+    from django.urls import reverse
+except ImportError:
+    from django.core.urlresolvers import reverse
+
+
+class LocalHubTest(TestCase):
+    def test_publish(self):
+        hub = LocalHub()
+        foo = hub.subscribe('foo')
+        bar = hub.subscribe('bar')
+
+        event = hub.publish('foo', {'widget': 'spam'})
+        self.assertEqual(event, {'widget': 'spam', 'id': 1})
+        self.assertEqual(foo.get(0), event)
+
+        # Other channels don't get it
+        self.assertIsNone(bar.get(0))
+
+        # Unsubscribed
+        foo.close()
+        foo.close()
+        hub.publish('foo', {'widget': 'spam'})
+        self.assertIsNone(foo.get(0))
+
+    def test_async(self):
+        hub = LocalHub()
+
+        async def listen():
+            subscription = hub.subscribe('foo', asynchronous=True)
+            # Published from another thread
+            thread = threading.Thread(
+                target=hub.publish, args=('foo', {'widget': 'spam'}))
+            thread.start()
+            try:
+                return await subscription.get(1)
+            finally:
+                thread.join()
+                subscription.close()
+
+        self.assertEqual(asyncio.run(listen()), {'widget': 'spam', 'id': 1})
+
+        async def timeout():
+            subscription = hub.subscribe('foo', asynchronous=True)
+            return await subscription.get(0.01)
+
+        self.assertIsNone(asyncio.run(timeout()))
+
+    def test_once(self):
+        hub = LocalHub()
+        calls = []
+
+        def func():
+            calls.append(1)
+            return len(calls)
+
+        self.assertEqual(hub.once('foo', func), 1)
+        self.assertEqual(hub.once('foo', func), 1)
+        self.assertEqual(hub.once('bar', func), 2)
+
+        def fail():
+            raise ValueError
+
+        with self.assertRaises(ValueError):
+            hub.once('baz', fail)
+        # Everybody gets the error
+        with self.assertRaises(ValueError):
+            hub.once('baz', func)
+
+        # Bounded
+        hub.max_results = 2
+        hub.once('egg', func)
+        self.assertNotIn('foo', hub._results)
+
+
+@override_settings(CONTROLCENTER_DASHBOARDS=[
+    ('foo', 'dashboards.ChartDashboard')])
+class BroadcastTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        User.objects.create_superuser(
+            'superuser', 'superuser@example.com', 'superpassword')
+        self.client.login(username='superuser', password='superpassword')
+
+    def test_get_hub(self):
+        self.assertIsInstance(get_hub(), LocalHub)
+        self.assertIs(get_hub(), get_hub())
+
+        hub = get_hub()
+        path = 'controlcenter.broadcast.LocalHub'
+        with override_settings(CONTROLCENTER_BROADCAST_HUB=path):
+            self.assertIsNot(get_hub(), hub)
+
+    def test_notify_changed(self):
+        from dashboards import MyChart
+
+        subscription = get_hub().subscribe('foo')
+        try:
+            MyChart.invalidate_cache()
+            event = subscription.get(0)
+        finally:
+            subscription.close()
+        self.assertEqual(event['widget'], 'mychart')
+
+    def test_stream(self):
+        from dashboards import MyChart
+
+        response = self.client.get(
+            reverse('controlcenter:stream', kwargs={'pk': 'foo'}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+
+        content = iter(response.streaming_content)
+        try:
+            self.assertEqual(next(content), b'retry: 5000\n\n')
+
+            # Chart's data is included
+            MyChart.invalidate_cache()
+            chunk = next(content).decode()
+            self.assertTrue(chunk.startswith('id: '))
+            self.assertIn('\nevent: widget\n', chunk)
+            data = json.loads(chunk.split('data: ', 1)[1])
+            self.assertEqual(data['widget'], 'mychart')
+            self.assertEqual(data['data']['series'], [[1, 2]])
+
+            # Others are fetched by viewers
+            broadcast.publish('foo', 'mywidget0')
+            data = json.loads(next(content).decode().split('data: ', 1)[1])
+            self.assertEqual(data['widget'], 'mywidget0')
+            self.assertNotIn('data', data)
+
+            # Heartbeat
+            with override_settings(CONTROLCENTER_STREAM_HEARTBEAT=0.01):
+                self.assertEqual(next(content), b': ping\n\n')
+        finally:
+            response.close()
+
+        # Unsubscribed
+        self.assertFalse(get_hub()._subscriptions['foo'])
+
+    def test_push_dashboard(self):
+        response = self.client.get('/admin/dashboard/foo/')
+        self.assertNotContains(response, 'data-stream')
+
+        with override_settings(CONTROLCENTER_PUSH_UPDATES=True):
+            response = self.client.get('/admin/dashboard/foo/')
+        self.assertContains(response,
+                            'data-stream="/admin/dashboard/foo/stream/"')
+        self.assertContains(
+            response,
+            'data-widget="mywidget0" '
+            'data-refresh-src="/admin/dashboard/foo/widget/mywidget0/">')
+
+    @override_settings(CONTROLCENTER_PUSH_UPDATES=True)
+    def test_blocking_stream(self):
+        # Test client's requests stand for ASGI ones of older Django
+        with mock.patch('controlcenter.views.ASYNC_STREAMING', False), \
+                mock.patch('controlcenter.views.ASGIRequest', WSGIRequest):
+            response = self.client.get(
+                reverse('controlcenter:stream', kwargs={'pk': 'foo'}))
+            self.assertEqual(response.status_code, 501)
+            self.assertFalse(get_hub()._subscriptions.get('foo'))
+
+            response = self.client.get('/admin/dashboard/foo/')
+            self.assertNotContains(response, 'data-stream')
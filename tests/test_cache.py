@@ -0,0 +1,52 @@
+from django.core.cache import cache as default_cache
+from django.core.cache import caches
+from django.test import RequestFactory
+
+from controlcenter import cache
+from controlcenter.widgets.core import BaseWidget
+
+from . import TestCase
+
+
+class CacheTest(TestCase):
+    def setUp(self):
+        default_cache.clear()
+
+    def test_get_cache(self):
+        self.assertIs(cache.get_cache(), caches['default'])
+
+    def test_make_key(self):
+        self.assertEqual(cache.make_key('foo', 1, None),
+                         'controlcenter:foo:1:None')
+        self.assertEqual(cache.make_digest(1, 'foo'),
+                         cache.make_digest(1, 'foo'))
+        self.assertNotEqual(cache.make_digest(1, 'foo'),
+                            cache.make_digest('1', 'foo'))
+
+    def test_generation(self):
+        self.assertEqual(cache.get_generation('foo'), 1)
+        self.assertEqual(cache.get_generation('foo'), 1)
+        self.assertEqual(cache.bump_generation('foo'), 2)
+        self.assertEqual(cache.get_generation('foo'), 2)
+
+        # Bumps the missing one
+        self.assertEqual(cache.bump_generation('bar'), 2)
+        self.assertEqual(cache.get_generation('bar'), 2)
+
+    def test_vary_on(self):
+        request = RequestFactory().get('/', {'b': 1, 'a': [2, 3]})
+        widget = BaseWidget(request)
+
+        # No user, no dashboard
+        self.assertEqual(
+            cache.vary_on(widget, ['user', 'params', 'dashboard']),
+            [None, [('a', ['2', '3']), ('b', ['1'])], None])
+
+        # Callables
+        self.assertEqual(cache.vary_on(widget, [lambda x: x.slug]),
+                         ['basewidget'])
+
+        # No request
+        widget = BaseWidget(None)
+        self.assertEqual(cache.vary_on(widget, ['user', 'params']),
+                         [None, None])
@@ -0,0 +1,76 @@
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.test.utils import override_settings
+
+from dashboards import MyCachedWidget
+
+from . import TestCase
+
+
+@override_settings(CONTROLCENTER_DASHBOARDS=[
+    ('foo', 'dashboards.CachedDashboard'),
+    ('bar', 'dashboards.NonEmptyDashboard'),
+])
+class WarmCommandTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        User.objects.create_superuser(
+            'superuser', 'superuser@example.com', 'superpassword')
+
+    def call(self, *args):
+        stdout = StringIO()
+        call_command('controlcenter_warm', *args, stdout=stdout)
+        return stdout.getvalue()
+
+    def get_cached(self):
+        widget = MyCachedWidget(request=None)
+        return cache.get(widget.get_data_cache_key('values'))
+
+    def test_warm(self):
+        output = self.call()
+        self.assertIn('foo.mycachedwidget: ', output)
+        self.assertIn('Warmed 1 widgets', output)
+
+        # Widgets with no data cache are skipped
+        self.assertNotIn('mywidget0', output)
+
+        value, computed_at = self.get_cached()
+        self.assertEqual(value, ['superuser'])
+
+        # Computes it again
+        self.call('--parallel', '2')
+        self.assertGreater(self.get_cached()[1], computed_at)
+
+    def test_select(self):
+        output = self.call('-d', 'bar')
+        self.assertIn('Warmed 0 widgets', output)
+        self.assertIsNone(self.get_cached())
+
+        output = self.call('-d', 'foo', '-w', 'mywidget0')
+        self.assertIn('Warmed 0 widgets', output)
+
+        output = self.call('-d', 'foo', '-w', 'mycachedwidget')
+        self.assertIn('Warmed 1 widgets', output)
+
+        with self.assertRaises(CommandError):
+            self.call('-d', 'baz')
+
+    def test_user(self):
+        User.objects.create_user('staff', 'staff@example.com', 'password',
+                                 is_staff=True)
+        self.call('--user', 'staff')
+        self.assertEqual(self.get_cached()[0], ['staff'])
+
+        with self.assertRaises(CommandError):
+            self.call('--user', 'unknown')
+
+    @mock.patch('time.sleep', side_effect=[None, KeyboardInterrupt])
+    def test_loop(self, sleep):
+        with self.assertRaises(KeyboardInterrupt):
+            self.call('--loop', '--interval', '5')
+        sleep.assert_called_with(5)
+        self.assertEqual(sleep.call_count, 2)
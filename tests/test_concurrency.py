@@ -0,0 +1,394 @@
+import asyncio
+import threading
+import time
+from unittest import mock, skipIf, skipUnless
+
+from django import VERSION
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.http import Http404
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from controlcenter import Dashboard, widgets
+from controlcenter.concurrency import (
+    aevaluate_widgets,
+    evaluate_widget,
+    evaluate_widgets,
+    get_cached_attrs,
+    run_in_background,
+)
+
+from . import TestCase
+
+try:
+    from django.urls import reverse
+except ImportError:
+    from django.core.urlresolvers import reverse
+
+try:
+    from asgiref.sync import async_to_sync
+    from django.test import AsyncRequestFactory
+except ImportError:
+    # Django < 3.1
+    async_to_sync = AsyncRequestFactory = None
+
+
+class ThreadChart(widgets.LineChart):
+    def values(self):
+        return threading.current_thread().name
+
+    def series(self):
+        return [[1, 2, 3]]
+
+
+class BrokenChart(widgets.LineChart):
+    def labels(self):
+        raise ValueError('Nope')
+
+    def series(self):
+        return [[1]]
+
+    def values(self):
+        return []
+
+
+class AsyncChart(widgets.LineChart):
+    async def values(self):
+        await asyncio.sleep(0)
+        return 'values'
+
+    async def series(self):
+        await asyncio.sleep(0.2)
+        return [[1]]
+
+    def labels(self):
+        # Sync methods run on threads
+        time.sleep(0.2)
+        return ['a']
+
+
+class AsyncOnlyChart(widgets.LineChart):
+    data_cache_timeout = 60
+
+    async def series(self):
+        await asyncio.sleep(0.2)
+        return [[threading.current_thread().name]]
+
+    def values(self):
+        return []
+
+
+class SlowChart(widgets.LineChart):
+    timeout = 0.1
+
+    def series(self):
+        time.sleep(0.5)
+        return [[1]]
+
+
+class BusyChart(ThreadChart):
+    timeout = 0.3
+
+    def series(self):
+        time.sleep(0.1)
+        return [[1]]
+
+
+class TimeoutDashboard(Dashboard):
+    concurrent = True
+    widgets = (SlowChart, ThreadChart)
+
+
+class ConcurrentDashboard(Dashboard):
+    concurrent = True
+    widgets = (ThreadChart, BrokenChart)
+
+
+class AsyncDashboard(Dashboard):
+    widgets = (AsyncChart, (AsyncChart, ThreadChart))
+
+
+class ConcurrencyTest(TestCase):
+    def test_cached_attrs(self):
+        self.assertItemsEqual(
+            get_cached_attrs(ThreadChart(request=None)),
+            ['values', 'labels', 'series', 'legend'])
+        self.assertItemsEqual(get_cached_attrs(widgets.ItemList(None)),
+                              ['values'])
+
+    def test_evaluate_widget(self):
+        widget = evaluate_widget(ThreadChart(request=None))
+
+        # Values are cached now
+        self.assertEqual(widget.__dict__['series'], [[1, 2, 3]])
+        self.assertEqual(widget.__dict__['labels'], [])
+        self.assertItemsEqual(widget.timings,
+                              ['values', 'labels', 'series', 'legend'])
+
+    def test_evaluate_queryset(self):
+        User.objects.create_user('user', 'user@example.com', 'password')
+
+        class UserList(widgets.ItemList):
+            model = User
+
+        widget = evaluate_widget(UserList(request=None))
+        with self.assertNumQueries(0):
+            self.assertEqual(len(widget.values), 1)
+
+    def test_evaluate_broken(self):
+        widget = evaluate_widget(BrokenChart(request=None))
+
+        # Error is raised again on access
+        self.assertNotIn('labels', widget.__dict__)
+        self.assertEqual(widget.series, [[1]])
+        with self.assertRaises(ValueError):
+            widget.labels
+
+    def test_evaluate_widgets(self):
+        main = threading.current_thread().name
+        items = [ThreadChart(request=None) for i in range(4)]
+        self.assertEqual(evaluate_widgets(items, max_workers=2), items)
+        for widget in items:
+            self.assertNotEqual(widget.__dict__['values'], main)
+
+        # Nothing to do
+        self.assertEqual(evaluate_widgets([]), [])
+
+    def test_run_in_background(self):
+        future = run_in_background(lambda x: x * 2, 21)
+        self.assertEqual(future.result(timeout=5), 42)
+
+        with self.assertLogs('controlcenter', 'ERROR'):
+            future = run_in_background(lambda: 1 / 0)
+            with self.assertRaises(ZeroDivisionError):
+                future.result(timeout=5)
+
+    def test_dashboard(self):
+        dashboard = ConcurrentDashboard(pk='0')
+        self.assertTrue(dashboard.is_concurrent())
+
+        groups = dashboard.evaluate_widgets(dashboard.get_widgets(None))
+        self.assertEqual(len(groups), 2)
+        self.assertIn('series', groups[0][0].__dict__)
+
+        # Falls back to settings
+        dashboard.concurrent = None
+        self.assertFalse(dashboard.is_concurrent())
+        with self.settings(CONTROLCENTER_CONCURRENT_WIDGETS=True):
+            self.assertTrue(dashboard.is_concurrent())
+
+    @override_settings(
+        CONTROLCENTER_CONCURRENT_WIDGETS=True,
+        CONTROLCENTER_DASHBOARDS=['dashboards.NonEmptyDashboard'])
+    def test_view(self):
+        User.objects.create_superuser(
+            'superuser', 'superuser@example.com', 'superpassword')
+        self.client.login(username='superuser', password='superpassword')
+        url = reverse('controlcenter:dashboard', kwargs={'pk': 0})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsInstance(response.context['groups'], list)
+
+
+@skipIf(AsyncRequestFactory is None, 'Django 3.1 or newer is required')
+class AsyncTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.superuser = User.objects.create_superuser(
+            'superuser', 'superuser@example.com', 'superpassword')
+
+    @skipIf(VERSION < (4, 1), 'Async ORM requires Django 4.1')
+    def test_async_orm(self):
+        class UserCount(widgets.ItemList):
+            async def values(self):
+                return await User.objects.acount()
+
+        self.assertEqual(UserCount(request=None).values, 1)
+
+    def test_sync_access(self):
+        widget = AsyncChart(request=None)
+        self.assertEqual(widget.values, 'values')
+        self.assertEqual(widget.series, [[1]])
+        self.assertEqual(widget.labels, ['a'])
+
+    def test_aevaluate_widgets(self):
+        items = [AsyncChart(request=None) for i in range(4)]
+
+        started = time.perf_counter()
+        self.assertEqual(async_to_sync(aevaluate_widgets)(items), items)
+        spent = time.perf_counter() - started
+
+        # Waits for the slowest one, not for all of them
+        self.assertLess(spent, 4 * 0.4)
+        for widget in items:
+            self.assertEqual(widget.__dict__['values'], 'values')
+            self.assertEqual(widget.__dict__['series'], [[1]])
+            self.assertEqual(widget.__dict__['labels'], ['a'])
+
+        # Nothing to do
+        self.assertEqual(async_to_sync(aevaluate_widgets)([]), [])
+
+    def test_aevaluate_on_loop(self):
+        items = [AsyncOnlyChart(request=None) for i in range(4)]
+
+        async def evaluate():
+            started = time.perf_counter()
+            await aevaluate_widgets(items, max_workers=1)
+            return time.perf_counter() - started, threading.current_thread()
+
+        # Awaited together, workers are not used at all
+        spent, thread = async_to_sync(evaluate)()
+        self.assertLess(spent, 2 * 0.2)
+        for widget in items:
+            self.assertEqual(widget.__dict__['series'], [[thread.name]])
+            self.assertGreater(widget.evaluation_time, 0)
+
+        # Data cache is used the same way
+        widget = AsyncOnlyChart(request=None)
+        async_to_sync(aevaluate_widgets)([widget])
+        self.assertEqual(widget.__dict__['series'], [[thread.name]])
+        self.assertEqual(widget.get_profile()['data_cache'], 'hit')
+
+    @skipIf(VERSION < (4, 1), 'Async views require Django 4.1')
+    @override_settings(CONTROLCENTER_DASHBOARDS=[
+        ('foo', 'tests.test_concurrency.AsyncDashboard')])
+    def test_view(self):
+        from controlcenter.views import AsyncDashboardView
+
+        view = AsyncDashboardView.as_view()
+        self.assertTrue(asyncio.iscoroutinefunction(view))
+
+        request = AsyncRequestFactory().get('/admin/dashboard/foo/')
+        request.user = self.superuser
+        response = async_to_sync(view)(request, pk='foo')
+        self.assertEqual(response.status_code, 200)
+        response.render()
+
+        groups = response.context_data['groups']
+        self.assertEqual([len(x) for x in groups], [1, 2])
+        for widget in groups[1]:
+            self.assertIn('series', widget.__dict__)
+        self.assertContains(response, 'chart_asyncchart')
+
+        # Staff only
+        request.user = AnonymousUser()
+        response = async_to_sync(view)(request, pk='foo')
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            response.url,
+            '{}?next=/admin/dashboard/foo/'.format(reverse('admin:login')))
+
+        # Unknown dashboard
+        request.user = self.superuser
+        with self.assertRaises(Http404):
+            async_to_sync(view)(request, pk='bar')
+
+    @skipUnless(VERSION < (4, 1), 'Async views are supported')
+    def test_view_unsupported(self):
+        from controlcenter.views import AsyncDashboardView
+
+        with self.assertRaises(ImproperlyConfigured):
+            AsyncDashboardView.as_view()
+
+
+class TimeoutTest(TestCase):
+    def test_evaluate_widgets(self):
+        items = [SlowChart(request=None), ThreadChart(request=None)]
+        started = time.perf_counter()
+        with self.assertLogs('controlcenter', 'WARNING') as logs:
+            evaluate_widgets(items)
+
+        # The page doesn't wait for it
+        self.assertLess(time.perf_counter() - started, 0.4)
+        self.assertIn('timed out after 0.1s', logs.output[0])
+        self.assertTrue(items[0].timed_out)
+        self.assertFalse(items[1].timed_out)
+        self.assertIn('series', items[1].__dict__)
+
+    def test_queued(self):
+        # Time in the queue doesn't count
+        items = [BusyChart(request=None) for i in range(4)]
+        evaluate_widgets(items, max_workers=1)
+        for widget in items:
+            self.assertFalse(widget.timed_out)
+            self.assertEqual(widget.__dict__['series'], [[1]])
+
+        # Unless workers are taken by hung widgets
+        items = [SlowChart(request=None), BusyChart(request=None)]
+        started = time.perf_counter()
+        with self.assertLogs('controlcenter', 'WARNING') as logs:
+            evaluate_widgets(items, max_workers=1)
+        self.assertLess(time.perf_counter() - started, 0.4)
+        self.assertEqual(len(logs.output), 2)
+        self.assertTrue(items[0].timed_out)
+        self.assertTrue(items[1].timed_out)
+        self.assertNotIn('series', items[1].__dict__)
+
+    @skipIf(async_to_sync is None, 'Django 3.0 or newer is required')
+    def test_aevaluate_widgets(self):
+        items = [SlowChart(request=None), ThreadChart(request=None)]
+
+        async def evaluate():
+            # Loop made by async_to_sync waits for threads on exit,
+            # server's loop doesn't
+            started = time.perf_counter()
+            await aevaluate_widgets(items)
+            return time.perf_counter() - started
+
+        with self.assertLogs('controlcenter', 'WARNING'):
+            self.assertLess(async_to_sync(evaluate)(), 0.4)
+        self.assertTrue(items[0].timed_out)
+        self.assertFalse(items[1].timed_out)
+
+        # Time in the queue doesn't count either
+        items = [BusyChart(request=None) for i in range(4)]
+        async_to_sync(aevaluate_widgets)(items, max_workers=1)
+        for widget in items:
+            self.assertFalse(widget.timed_out)
+            self.assertEqual(widget.__dict__['series'], [[1]])
+
+    @override_settings(CONTROLCENTER_DASHBOARDS=[
+        ('foo', 'tests.test_concurrency.TimeoutDashboard')])
+    def test_view(self):
+        User.objects.create_superuser(
+            'superuser', 'superuser@example.com', 'superpassword')
+        self.client.login(username='superuser', password='superpassword')
+
+        with self.assertLogs('controlcenter', 'WARNING'):
+            response = self.client.get('/admin/dashboard/foo/')
+        self.assertContains(response, 'Took too long to load.')
+        self.assertContains(
+            response, '<a href="/admin/dashboard/foo/widget/slowchart/" '
+                      'data-retry>Retry</a>')
+        self.assertContains(response, 'chart_threadchart')
+
+        # Fragment is evaluated with the timeout too
+        with self.assertLogs('controlcenter', 'WARNING'):
+            response = self.client.get(
+                '/admin/dashboard/foo/widget/slowchart/')
+        self.assertContains(response, 'data-retry>Retry</a>')
+
+    def test_statement_timeout(self):
+        widget = SlowChart(request=None)
+        widget.use_statement_timeout = True
+
+        # Not a postgres
+        with CaptureQueriesContext(connection) as queries:
+            with widget.limit_statements():
+                pass
+        self.assertEqual(len(queries), 0)
+
+        fake = mock.MagicMock(vendor='postgresql')
+        cursor = fake.cursor.return_value.__enter__.return_value
+        cursor.fetchone.return_value = ['0']
+        with mock.patch('controlcenter.widgets.core.connections',
+                        {'default': fake}):
+            with widget.limit_statements():
+                cursor.execute.assert_called_with(
+                    "SELECT set_config('statement_timeout', %s, false)",
+                    ['100'])
+        # Restored
+        cursor.execute.assert_called_with(
+            "SELECT set_config('statement_timeout', %s, false)", ['0'])
@@ -1,8 +1,13 @@
+from unittest import mock
+
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.core.exceptions import ImproperlyConfigured
 from django.test.utils import override_settings
 
-from controlcenter import widgets
+from controlcenter import app_settings, widgets
+from controlcenter.dashboards import get_dashboards, reset_dashboards
+from controlcenter.widgets.core import BaseWidget
 
 from . import TestCase
 
@@ -137,3 +142,300 @@ class B_DashboardTest(TestCase):
             self.assertEqual(expected_url, '/admin/dashboard/foo/')
             response = self.client.get(url)
             self.assertRedirects(response, expected_url)
+
+
+class C_WidgetViewTest(TestCase):
+    def setUp(self):
+        User.objects.create_superuser(
+            'superuser', 'superuser@example.com', 'superpassword')
+        self.client.login(username='superuser', password='superpassword')
+
+    @override_settings(
+        CONTROLCENTER_DASHBOARDS=[('foo', 'dashboards.NonEmptyDashboard')])
+    def test_get_widget(self):
+        response = self.client.get('/admin/dashboard/foo/')
+        dashboard = response.context['dashboard']
+
+        # Widgets within groups are found too
+        for slug in ('mywidget0', 'mywidget1'):
+            widget = dashboard.get_widget(None, slug)
+            self.assertEqual(widget.slug, slug)
+            self.assertIs(widget.dashboard, dashboard)
+            self.assertEqual(widget.get_absolute_url(),
+                             '/admin/dashboard/foo/widget/{}/'.format(slug))
+        self.assertIsNone(dashboard.get_widget(None, 'unknown'))
+
+        # No dashboard no url
+        self.assertIsNone(widgets.Widget(request=None).get_absolute_url())
+
+    @override_settings(
+        CONTROLCENTER_DASHBOARDS=[('foo', 'dashboards.NonEmptyDashboard')])
+    def test_widget_view(self):
+        url = reverse('controlcenter:widget',
+                      kwargs={'pk': 'foo', 'slug': 'mywidget1'})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['widget'].slug, 'mywidget1')
+        self.assertTemplateUsed(response, 'controlcenter/widget.html')
+        self.assertTemplateNotUsed(response, 'controlcenter/dashboard.html')
+
+        # Conditional get
+        self.assertTrue(response['ETag'])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        # Unknown widget and dashboard
+        response = self.client.get('/admin/dashboard/foo/widget/unknown/')
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get('/admin/dashboard/bar/widget/mywidget1/')
+        self.assertEqual(response.status_code, 404)
+
+        # Staff only
+        self.client.logout()
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 302)
+
+    @override_settings(
+        CONTROLCENTER_DEFERRED_WIDGETS=True,
+        CONTROLCENTER_DASHBOARDS=[('foo', 'dashboards.NonEmptyDashboard')])
+    def test_deferred_dashboard(self):
+        response = self.client.get('/admin/dashboard/foo/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['deferred'])
+        self.assertContains(
+            response, 'data-src="/admin/dashboard/foo/widget/mywidget0/"')
+        self.assertContains(
+            response, 'data-src="/admin/dashboard/foo/widget/mywidget1/"')
+        self.assertTemplateNotUsed(response,
+                                   'controlcenter/widgets/chart.html')
+
+
+class D_RegistryTest(TestCase):
+    def setUp(self):
+        reset_dashboards()
+
+    @override_settings(CONTROLCENTER_DASHBOARDS=[
+        ('foo', 'dashboards.EmptyDashboard'),
+        ('bar', 'dashboards.NonEmptyDashboard'),
+    ])
+    def test_memoized(self):
+        dashboards = get_dashboards()
+        self.assertEqual(list(dashboards), ['foo', 'bar'])
+        self.assertEqual(dashboards['bar'].pk, 'bar')
+        self.assertIs(get_dashboards(), dashboards)
+
+        # Reset hook
+        reset_dashboards()
+        self.assertIsNot(get_dashboards(), dashboards)
+
+    def test_settings_changed(self):
+        with self.settings(CONTROLCENTER_DASHBOARDS=[
+                'dashboards.EmptyDashboard']):
+            dashboards = get_dashboards()
+            self.assertEqual(list(dashboards), ['0'])
+
+        with self.settings(CONTROLCENTER_DASHBOARDS=[
+                'dashboards.EmptyDashboard', 'dashboards.EmptyDashboard']):
+            self.assertEqual(list(get_dashboards()), ['0', '1'])
+
+            # Changed with no signal
+            app_settings.DASHBOARDS.append('dashboards.NonEmptyDashboard')
+            self.assertEqual(list(get_dashboards()), ['0', '1', '2'])
+
+    @override_settings(CONTROLCENTER_DASHBOARDS=[
+        ('foo', 'dashboards.EmptyDashboard'),
+        ('foo', 'dashboards.NonEmptyDashboard'),
+    ])
+    def test_duplicates(self):
+        with self.assertRaises(ImproperlyConfigured):
+            get_dashboards()
+
+    @override_settings(CONTROLCENTER_DASHBOARDS=[
+        ('foo', 'dashboards.EmptyDashboard')])
+    def test_view(self):
+        User.objects.create_superuser(
+            'superuser', 'superuser@example.com', 'superpassword')
+        self.client.login(username='superuser', password='superpassword')
+        response0 = self.client.get('/admin/dashboard/foo/')
+        response1 = self.client.get('/admin/dashboard/foo/')
+        self.assertIs(response0.context['dashboard'],
+                      response1.context['dashboard'])
+
+
+@override_settings(CONTROLCENTER_DASHBOARDS=[
+    ('foo', 'dashboards.ChartDashboard')])
+class E_WidgetDataViewTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        User.objects.create_superuser(
+            'superuser', 'superuser@example.com', 'superpassword')
+        self.client.login(username='superuser', password='superpassword')
+        self.url = reverse('controlcenter:widget_data',
+                           kwargs={'pk': 'foo', 'slug': 'mychart'})
+
+    def test_data(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        data = response.json()
+        self.assertEqual(data['labels'], ['a', 'b'])
+        self.assertEqual(data['series'], [[1, 2]])
+        self.assertEqual(data['legend'], ['Numbers'])
+        self.assertEqual(data['chartist']['klass'], 'Line')
+        self.assertTrue(data['chartist']['options']['reverseData'])
+
+        # Headers
+        self.assertTrue(response['ETag'])
+        self.assertTrue(response['Last-Modified'])
+        self.assertIn('no-cache', response['Cache-Control'])
+
+    def test_conditional(self):
+        response = self.client.get(self.url)
+        etag = response['ETag']
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+
+        response = self.client.get(
+            self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH='"foo"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_not_modified_cached(self):
+        from dashboards import MyChart
+
+        response = self.client.get(self.url)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+
+        # Data is fresh, so the widget is not even evaluated
+        with mock.patch.object(BaseWidget, 'evaluate_attr') as evaluate:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response['Last-Modified'], last_modified)
+        evaluate.assert_not_called()
+
+        # Other urls are evaluated to compare
+        spy = mock.patch.object(BaseWidget, 'evaluate_attr', autospec=True,
+                                side_effect=BaseWidget.evaluate_attr)
+        with spy as evaluate:
+            response = self.client.get(self.url + '?foo=1',
+                                       HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertTrue(evaluate.called)
+
+        # Invalidated data is evaluated again
+        MyChart.invalidate_cache()
+        with spy as evaluate:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertTrue(evaluate.called)
+
+    def test_not_found(self):
+        # Not a chart
+        url = reverse('controlcenter:widget_data',
+                      kwargs={'pk': 'foo', 'slug': 'mywidget0'})
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+        url = reverse('controlcenter:widget_data',
+                      kwargs={'pk': 'foo', 'slug': 'unknown'})
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_fetch_data(self):
+        from dashboards import MyChart
+
+        MyChart.fetch_data = True
+        try:
+            response = self.client.get('/admin/dashboard/foo/')
+        finally:
+            MyChart.fetch_data = False
+
+        self.assertContains(
+            response, "controlcenter.fetchChart('#chart_mychart', "
+                      "'/admin/dashboard/foo/widget/mychart/data/');")
+        self.assertNotContains(response, 'controlcenter.renderChart')
+
+        # Renders data inline
+        response = self.client.get('/admin/dashboard/foo/')
+        self.assertContains(response, 'controlcenter.renderChart(')
+        self.assertContains(response, 'Numbers')
+
+    def test_refresh_interval(self):
+        from dashboards import MyChart, MyWidget0
+
+        response = self.client.get('/admin/dashboard/foo/')
+        self.assertNotContains(response, 'data-refresh')
+
+        MyChart.refresh_interval = MyWidget0.refresh_interval = 30
+        try:
+            response = self.client.get('/admin/dashboard/foo/')
+        finally:
+            MyChart.refresh_interval = MyWidget0.refresh_interval = None
+
+        # Charts poll data, other widgets poll html
+        self.assertContains(
+            response,
+            'data-refresh="30" data-widget="mychart" '
+            'data-refresh-src="/admin/dashboard/foo/widget/mychart/data/" '
+            'data-chart="chart_mychart"')
+        self.assertContains(
+            response,
+            'data-refresh="30" data-widget="mywidget0" '
+            'data-refresh-src="/admin/dashboard/foo/widget/mywidget0/">')
+
+
+@override_settings(
+    CONTROLCENTER_DASHBOARDS=[('foo', 'dashboards.ChartDashboard')])
+class F_ProfilingTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        User.objects.create_superuser(
+            'superuser', 'superuser@example.com', 'superpassword')
+        self.client.login(username='superuser', password='superpassword')
+
+    def test_server_timing(self):
+        response = self.client.get('/admin/dashboard/foo/')
+        timing = response['Server-Timing']
+        self.assertIn('mychart-data;dur=', timing)
+        self.assertIn('desc="0 queries, data cache miss"', timing)
+        self.assertIn('mychart-render;dur=', timing)
+        self.assertIn('mywidget0-data;dur=', timing)
+        self.assertIn('total;dur=', timing)
+
+        response = self.client.get('/admin/dashboard/foo/')
+        self.assertIn('desc="0 queries, data cache hit"',
+                      response['Server-Timing'])
+
+        # Fragments have got it too
+        response = self.client.get(
+            '/admin/dashboard/foo/widget/mychart/')
+        timing = response['Server-Timing']
+        self.assertIn('mychart-data;dur=', timing)
+        self.assertNotIn('mywidget0', timing)
+
+        # And the data
+        response = self.client.get(
+            '/admin/dashboard/foo/widget/mychart/data/')
+        self.assertIn('mychart-data;dur=', response['Server-Timing'])
+
+        with override_settings(CONTROLCENTER_SERVER_TIMING=False):
+            response = self.client.get('/admin/dashboard/foo/')
+        self.assertFalse(response.has_header('Server-Timing'))
+
+    def test_deferred(self):
+        with override_settings(CONTROLCENTER_DEFERRED_WIDGETS=True):
+            response = self.client.get('/admin/dashboard/foo/')
+        self.assertNotIn('mywidget0', response['Server-Timing'])
+
+    def test_profile(self):
+        response = self.client.get('/admin/dashboard/foo/')
+        self.assertNotContains(response, 'controlcenter__profile')
+
+        response = self.client.get('/admin/dashboard/foo/?_cc_profile=1')
+        self.assertContains(response, 'class="controlcenter__profile"')
+        # Data has been cached by the previous request
+        self.assertContains(response, '>hit</td>')
@@ -0,0 +1,63 @@
+import math
+import random
+from unittest import skipUnless
+
+from controlcenter import downsample
+
+from . import TestCase
+
+
+class DownsampleTest(TestCase):
+    def test_lttb(self):
+        ys = [math.sin(x / 10.0) for x in range(1000)]
+        indices = downsample.lttb(ys, 50)
+        self.assertEqual(len(indices), 50)
+        self.assertEqual(indices, sorted(set(indices)))
+        # Edges are always kept
+        self.assertEqual(indices[0], 0)
+        self.assertEqual(indices[-1], 999)
+
+        # Peaks are kept
+        peak = max(range(1000), key=ys.__getitem__)
+        self.assertTrue(any(abs(x - peak) < 20 for x in indices))
+        spike = ys[:]
+        spike[500] = 100
+        self.assertIn(500, downsample.lttb(spike, 50))
+
+        # Nothing to do
+        self.assertEqual(downsample.lttb([1, 2, 3], 50), [0, 1, 2])
+        self.assertEqual(downsample.lttb([], 50), [])
+
+        # Too few points for triangles
+        self.assertEqual(downsample.lttb(ys, 2), [0, 999])
+        self.assertEqual(downsample.lttb(ys, 1), [0])
+
+    def test_lttb_xs(self):
+        xs = [x * x for x in range(100)]
+        ys = [None if x % 7 else x for x in range(100)]
+        indices = downsample.lttb(ys, 10, xs)
+        self.assertEqual(len(indices), 10)
+
+    def test_minmax(self):
+        ys = [random.random() for x in range(1000)]
+        ys[123], ys[456] = 10, -10
+        indices = downsample.minmax(ys, 100)
+        self.assertLessEqual(len(indices), 100)
+        self.assertEqual(indices, sorted(indices))
+        self.assertIn(123, indices)
+        self.assertIn(456, indices)
+        self.assertEqual(downsample.minmax([1, 2], 100), [0, 1])
+        self.assertEqual(downsample.minmax(ys, 1), [123])
+
+    @skipUnless(downsample.numpy, 'NumPy is not installed')
+    def test_numpy(self):
+        ys = [random.random() for x in range(1000)]
+        expected = downsample._lttb(list(range(1000)), ys, 50)
+        self.assertEqual(downsample.lttb(ys, 50), expected)
+
+        numpy, downsample.numpy = downsample.numpy, None
+        try:
+            expected = downsample.minmax(ys, 50)
+        finally:
+            downsample.numpy = numpy
+        self.assertEqual(downsample.minmax(ys, 50), expected)
@@ -0,0 +1,264 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test.utils import override_settings
+
+from controlcenter import Dashboard, metrics, widgets
+from controlcenter.utils import count_queries
+
+from . import TestCase
+
+
+class UserCount(widgets.ItemList):
+    max_queries = 1
+
+    def values(self):
+        return [User.objects.count()]
+
+
+class GreedyUserCount(UserCount):
+    budget_defer_timeout = 60
+
+    def values(self):
+        User.objects.count()
+        return [User.objects.count()]
+
+
+class BudgetDashboard(Dashboard):
+    widgets = (UserCount, GreedyUserCount)
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.reset_metrics()
+
+    def test_count_queries(self):
+        with count_queries() as counter:
+            User.objects.count()
+            User.objects.exists()
+        self.assertEqual(counter.count, 2)
+        self.assertGreater(counter.time, 0)
+
+    def test_record(self):
+        metrics.record('foo', 2, 0.5, 1.0)
+        metrics.record('foo', 1, 0.5, 2.0)
+        metrics.record_breach('foo')
+        self.assertEqual(metrics.get_metrics(), {'foo': {
+            'evaluations': 2,
+            'queries': 3,
+            'sql_time': 1.0,
+            'time': 3.0,
+            'max_time': 2.0,
+            'breaches': 1,
+        }})
+
+        metrics.reset_metrics()
+        self.assertEqual(metrics.get_metrics(), {})
+
+    def test_measure(self):
+        class UserChart(widgets.LineChart):
+            def values(self):
+                return list(User.objects.all())
+
+            def series(self):
+                # Values' queries are counted once
+                return [[len(self.values)]]
+
+        widget = UserChart(request=None)
+        self.assertEqual(widget.series, [[0]])
+        self.assertEqual(widget.values, [])
+        self.assertEqual(widget.queries, 1)
+        self.assertGreater(widget.evaluation_time, 0)
+
+        name = UserChart.get_cache_name()
+        self.assertEqual(metrics.get_metrics()[name]['queries'], 1)
+        self.assertEqual(metrics.get_metrics()[name]['evaluations'], 1)
+
+    def test_budget(self):
+        widget = UserCount(request=None)
+        widget.values
+        self.assertFalse(widget.over_budget)
+
+        widget = GreedyUserCount(request=None)
+        with self.assertLogs('controlcenter', 'WARNING') as logs:
+            widget.values
+        self.assertTrue(widget.over_budget)
+        self.assertIn('GreedyUserCount is over budget: 2 queries',
+                      logs.output[0])
+        name = GreedyUserCount.get_cache_name()
+        self.assertEqual(metrics.get_metrics()[name]['breaches'], 1)
+
+        # Lazy querysets are counted as well
+        class UserList(widgets.ItemList):
+            model = User
+            max_queries = 0
+
+        widget = UserList(request=None)
+        with self.assertLogs('controlcenter', 'WARNING'):
+            widget.values
+        self.assertEqual(widget.queries, 1)
+        self.assertTrue(widget.over_budget)
+        with self.assertNumQueries(0):
+            list(widget.values)
+
+        # Time budget
+        widget = UserCount(request=None)
+        widget.max_time_ms = 0
+        with self.assertLogs('controlcenter', 'WARNING'):
+            widget.values
+        self.assertTrue(widget.over_budget)
+
+    def test_deferred(self):
+        dashboard = BudgetDashboard(pk='foo')
+        widget = dashboard.make_widget(GreedyUserCount, None)
+        self.assertFalse(widget.is_deferred())
+        with self.assertLogs('controlcenter', 'WARNING'):
+            widget.values
+
+        # Loaded separately for a while
+        widget = dashboard.make_widget(GreedyUserCount, None)
+        self.assertTrue(widget.is_deferred())
+        self.assertFalse(
+            dashboard.make_widget(UserCount, None).is_deferred())
+
+        groups = dashboard.evaluate_widgets(dashboard.get_widgets(None))
+        self.assertIn('values', groups[0][0].__dict__)
+        self.assertNotIn('values', groups[1][0].__dict__)
+
+    @override_settings(CONTROLCENTER_DASHBOARDS=[
+        ('foo', 'tests.test_metrics.BudgetDashboard')])
+    def test_view(self):
+        User.objects.create_superuser(
+            'superuser', 'superuser@example.com', 'superpassword')
+        self.client.login(username='superuser', password='superpassword')
+
+        with self.assertLogs('controlcenter', 'WARNING'):
+            response = self.client.get('/admin/dashboard/foo/')
+        self.assertNotContains(response, 'data-src')
+
+        response = self.client.get('/admin/dashboard/foo/')
+        self.assertContains(
+            response,
+            'data-src="/admin/dashboard/foo/widget/greedyusercount/"')
+        self.assertContains(response, 'Loading...', count=1)
+
+
+class ExpositionTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.reset_metrics()
+
+    def test_histogram(self):
+        name = 'controlcenter_widget_queries'
+        metrics.observe(name, 1, dashboard='foo', widget='bar')
+        metrics.observe(name, 7, dashboard='foo', widget='bar')
+        text = metrics.exposition()
+        self.assertIn('# TYPE controlcenter_widget_queries histogram\n', text)
+        labels = 'dashboard="foo",widget="bar"'
+        # Buckets are cumulative
+        self.assertIn(
+            'controlcenter_widget_queries_bucket{%s,le="0"} 0\n' % labels,
+            text)
+        self.assertIn(
+            'controlcenter_widget_queries_bucket{%s,le="1"} 1\n' % labels,
+            text)
+        self.assertIn(
+            'controlcenter_widget_queries_bucket{%s,le="10"} 2\n' % labels,
+            text)
+        self.assertIn(
+            'controlcenter_widget_queries_bucket{%s,le="+Inf"} 2\n' % labels,
+            text)
+        self.assertIn('controlcenter_widget_queries_sum{%s} 8\n' % labels,
+                      text)
+        self.assertIn('controlcenter_widget_queries_count{%s} 2\n' % labels,
+                      text)
+        # Nothing is observed, nothing is exposed
+        self.assertNotIn('render_seconds', text)
+
+    def test_counter(self):
+        name = 'controlcenter_widget_timeouts_total'
+        metrics.increment(name, widget='say "\\hi"\n')
+        metrics.increment(name, widget='say "\\hi"\n')
+        self.assertIn(
+            'controlcenter_widget_timeouts_total'
+            '{widget="say \\"\\\\hi\\"\\n"} 2\n',
+            metrics.exposition())
+
+    def test_record_widget(self):
+        class CachedUserCount(UserCount):
+            data_cache_timeout = 60
+
+        dashboard = BudgetDashboard(pk='foo')
+        for i in range(2):
+            widget = dashboard.make_widget(CachedUserCount, None)
+            widget.values
+            metrics.record_widget(widget)
+
+        text = metrics.exposition()
+        labels = 'dashboard="foo",widget="cachedusercount"'
+        self.assertIn(
+            'controlcenter_widget_evaluation_seconds_count{%s} 2' % labels,
+            text)
+        self.assertIn(
+            'controlcenter_widget_queries_bucket{%s,le="0"} 1' % labels,
+            text)
+        self.assertIn(
+            'controlcenter_widget_cache_requests_total'
+            '{cache="data",dashboard="foo",result="hit",'
+            'widget="cachedusercount"} 1', text)
+        self.assertIn(
+            'controlcenter_widget_cache_requests_total'
+            '{cache="data",dashboard="foo",result="miss",'
+            'widget="cachedusercount"} 1', text)
+
+    @override_settings(CONTROLCENTER_DASHBOARDS=[
+        ('foo', 'tests.test_metrics.BudgetDashboard')])
+    def test_view(self):
+        url = '/admin/dashboard/-/metrics/'
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+        User.objects.create_superuser(
+            'superuser', 'superuser@example.com', 'superpassword')
+        with override_settings(CONTROLCENTER_METRICS=True,
+                               CONTROLCENTER_METRICS_TOKEN='secret'):
+            self.assertEqual(self.client.get(url).status_code, 403)
+            response = self.client.get(
+                url, HTTP_AUTHORIZATION='Bearer wrong')
+            self.assertEqual(response.status_code, 403)
+            response = self.client.get(
+                url, HTTP_AUTHORIZATION='Bearer secret')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+
+            self.client.login(username='superuser', password='superpassword')
+            with self.assertLogs('controlcenter', 'WARNING'):
+                self.client.get('/admin/dashboard/foo/')
+            response = self.client.get(url)
+
+        self.assertContains(
+            response, 'controlcenter_widget_evaluation_seconds_count'
+            '{dashboard="foo",widget="usercount"} 1')
+        self.assertContains(
+            response, 'controlcenter_widget_budget_breaches_total'
+            '{dashboard="foo",widget="greedyusercount"} 1')
+
+        # Data urls are recorded too
+        with override_settings(CONTROLCENTER_METRICS=True,
+                               CONTROLCENTER_DASHBOARDS=[
+                                   ('bar', 'dashboards.ChartDashboard')]):
+            self.client.get('/admin/dashboard/bar/widget/mychart/data/')
+        self.assertIn('controlcenter_widget_evaluation_seconds_count'
+                      '{dashboard="bar",widget="mychart"} 1',
+                      metrics.exposition())
+
+        # Dashboard can be called that
+        with override_settings(CONTROLCENTER_DASHBOARDS=[
+                ('metrics', 'dashboards.NonEmptyDashboard')]):
+            response = self.client.get('/admin/dashboard/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['dashboard'].pk, 'metrics')
+
+        # Isn't collected unless enabled
+        metrics.reset_metrics()
+        self.client.get('/admin/dashboard/foo/')
+        self.assertEqual(metrics.exposition(), '\n')
@@ -0,0 +1,43 @@
+import datetime
+import json
+from decimal import Decimal
+from unittest import skipUnless
+
+from django.utils.translation import gettext_lazy
+
+from controlcenter import serializers
+
+from . import TestCase
+
+
+class SerializersTest(TestCase):
+    data = {
+        'date': datetime.datetime(2020, 1, 1, 12, 30, 15, 123456,
+                                  tzinfo=datetime.timezone.utc),
+        'decimal': Decimal('1.5'),
+        'lazy': gettext_lazy('Users'),
+        'series': [[1, 2.5, None]],
+    }
+    expected = {
+        'date': '2020-01-01T12:30:15.123Z',
+        'decimal': '1.5',
+        'lazy': 'Users',
+        'series': [[1, 2.5, None]],
+    }
+
+    def test_stdlib(self):
+        content = serializers.stdlib_dumps(self.data)
+        self.assertEqual(json.loads(content), self.expected)
+        self.assertNotIn(' ', content)
+
+    @skipUnless(serializers.orjson, 'orjson is not installed')
+    def test_orjson(self):
+        # Django's types are serialized the same way
+        self.assertEqual(serializers.orjson_dumps(self.data),
+                         serializers.stdlib_dumps(self.data))
+        self.assertEqual(serializers.orjson_dumps({1: 'a'}), '{"1":"a"}')
+
+    def test_dumps(self):
+        self.assertEqual(json.loads(serializers.dumps(self.data)),
+                         self.expected)
+        self.assertIs(serializers.get_serializer(), serializers.dumps)
@@ -1,9 +1,14 @@
 import collections
 import json
+import time
+from unittest import mock
 
 from django import VERSION
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
+from django.template import Context, Template, TemplateSyntaxError
+from django.test.utils import override_settings
+from django.urls import reverse
 
 from controlcenter import app_settings, widgets
 from controlcenter.templatetags.controlcenter_tags import (
@@ -28,7 +33,12 @@ class SimpleTagsTest(TestCase):
 
         # Marked safe
         self.assertTrue(hasattr(json_data, '__html__'))
-        self.assertEqual(json_data, json.dumps(data))
+        self.assertEqual(json.loads(json_data), data)
+        # Compact
+        self.assertNotIn(' ', json_data)
+
+        with override_settings(CONTROLCENTER_JSON_SERIALIZER='json.dumps'):
+            self.assertEqual(jsonify(data), json.dumps(data))
 
     def test_is_sequence(self):
         self.assertTrue(is_sequence(list()))
@@ -343,6 +353,34 @@ class ChangeurlTest(TestCase):
 
         self.equal(NoPkList, None)
 
+    def test_rows(self):
+        for widget in self.widgets:
+            class Widget(widget):
+                model = User
+                list_display = (app_settings.SHARP, 'pk', 'email')
+                limit_to = None
+
+            widget = Widget(request=None)
+            with mock.patch('controlcenter.widgets.core.reverse',
+                            wraps=reverse) as reverse_mock:
+                urls = [row.url for row in widget.rows]
+
+            # Reversed once per model
+            self.assertEqual(reverse_mock.call_count, 1)
+            self.assertEqual(urls, [
+                '/admin/auth/user/{}/change/'.format(x.pk)
+                for x in User.objects.all()])
+
+    def test_quote(self):
+        widget = self.ValuesDict(request=None)
+        for pk in ('a/b c_%?', 'ы', 42):
+            self.assertEqual(
+                widget.change_urls.get_url(User._meta, pk),
+                reverse('admin:auth_user_change', args=[pk]))
+
+        # Can't be reversed with empty string
+        self.assertIsNone(widget.change_urls.get_url(User._meta, ''))
+
 
 class ExternalLinkTest(TestCase):
     def test_no_label(self):
@@ -358,3 +396,31 @@ class ExternalLinkTest(TestCase):
             '<a href="http://example.com" target="_blank" '
             'rel="noreferrer" rel="noopener">my-example-link</a>',
         )
+
+
+class TimedTest(TestCase):
+    def test_timed(self):
+        class Slow(widgets.Widget):
+            def values(self):
+                time.sleep(0.05)
+                return [1]
+
+        widget = Slow(request=None)
+        template = Template(
+            '{% load controlcenter_tags %}'
+            '{% timed widget %}{{ widget.values.0 }}{% endtimed %}')
+        self.assertEqual(template.render(Context({'widget': widget})), '1')
+        self.assertEqual(widget.renders, 1)
+        # Evaluation is not counted as rendering
+        self.assertGreaterEqual(widget.evaluation_time, 0.05)
+        self.assertLess(widget.render_time, 0.05)
+
+        profile = widget.get_profile()
+        self.assertGreaterEqual(profile['data_time'], 50)
+        self.assertIsNone(profile['data_cache'])
+        self.assertIsNone(profile['body_cache'])
+
+    def test_syntax(self):
+        with self.assertRaises(TemplateSyntaxError):
+            Template('{% load controlcenter_tags %}'
+                     '{% timed %}{% endtimed %}')
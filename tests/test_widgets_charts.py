@@ -1,9 +1,21 @@
+import datetime
+import random
+from decimal import Decimal
+from unittest import mock
+
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.db.models import Count, Q
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
 
+from controlcenter import Dashboard
 from controlcenter.widgets.charts import (
     BAR,
     LINE,
+    MONTH,
     PIE,
     BarChart,
     Chart,
@@ -13,6 +25,7 @@ from controlcenter.widgets.charts import (
     SingleBarChart,
     SingleLineChart,
     SinglePieChart,
+    TimeSeriesChart,
 )
 
 from . import TestCase
@@ -89,6 +102,23 @@ class BaseTest(TestCase):
         self.assertEqual(chart.chartist.bar, 'bar0')
         self.assertEqual(chart.chartist.baz, 'baz1')
 
+    def test_json_data(self):
+        chart = LineChart(request=None)
+        config = chart.get_chartist_config()
+        self.assertEqual(config['klass'], LINE)
+        self.assertTrue(config['options']['reverseData'])
+
+        # It's a copy
+        config['klass'] = BAR
+        self.assertEqual(chart.chartist.klass, LINE)
+
+        self.assertEqual(chart.get_json_data(), {
+            'labels': [],
+            'series': [],
+            'legend': [],
+            'chartist': chart.get_chartist_config(),
+        })
+
     def test_linechart(self):
         chart = LineChart(request=None)
         self.assertEqual(chart.chartist.klass, LINE)
@@ -155,3 +185,363 @@ class WidgetTest(TestCase):
         self.assertItemsEqual(
             chart0.series,
             [list(User.objects.values_list('email', flat=True))])
+
+
+def utc(*args):
+    return datetime.datetime(*args, tzinfo=datetime.timezone.utc)
+
+
+class SignupChart(TimeSeriesChart):
+    model = User
+    date_field = 'date_joined'
+    time_range = datetime.timedelta(days=3)
+
+
+class ClosedSignupChart(SignupChart):
+    closed_buckets_timeout = 60
+
+
+class SignupDashboard(Dashboard):
+    widgets = [ClosedSignupChart]
+
+
+class TimeSeriesTest(TestCase):
+    def setUp(self):
+        joined = [
+            utc(2020, 1, 1, 20),
+            utc(2020, 1, 3, 1),
+            utc(2020, 1, 3, 12),
+            # Out of the range
+            utc(2019, 12, 1),
+        ]
+        for i, date_joined in enumerate(joined):
+            User.objects.create(username='user{}'.format(i),
+                                date_joined=date_joined, is_staff=i == 1)
+
+    def series(self, chart):
+        with mock.patch('django.utils.timezone.now',
+                        return_value=utc(2020, 1, 4, 10)):
+            return chart.series
+
+    def test_series(self):
+        chart = SignupChart(request=None)
+        with self.assertNumQueries(1):
+            series = self.series(chart)
+
+        # Empty buckets are filled
+        self.assertEqual(series, [[
+            {'x': utc(2020, 1, 1).timestamp(), 'y': 1},
+            {'x': utc(2020, 1, 2).timestamp(), 'y': 0},
+            {'x': utc(2020, 1, 3).timestamp(), 'y': 2},
+            {'x': utc(2020, 1, 4).timestamp(), 'y': 0},
+        ]])
+        self.assertEqual(chart.legend, [])
+
+    def test_aggregates(self):
+        class StaffChart(SignupChart):
+            aggregate = {
+                'Users': Count('pk'),
+                'Staff': Count('pk', filter=Q(is_staff=True)),
+            }
+
+        chart = StaffChart(request=None)
+        with self.assertNumQueries(1):
+            series = self.series(chart)
+        self.assertEqual([[x['y'] for x in s] for s in series],
+                         [[1, 0, 2, 0], [0, 0, 1, 0]])
+        self.assertEqual(chart.legend, ['Users', 'Staff'])
+
+    def test_tz(self):
+        class TokyoChart(SignupChart):
+            tz = 'Asia/Tokyo'
+
+        # Tokyo is 9 hours ahead
+        series = self.series(TokyoChart(request=None))
+        self.assertEqual(series, [[
+            {'x': utc(2019, 12, 31, 15).timestamp(), 'y': 0},
+            {'x': utc(2020, 1, 1, 15).timestamp(), 'y': 1},
+            {'x': utc(2020, 1, 2, 15).timestamp(), 'y': 2},
+            {'x': utc(2020, 1, 3, 15).timestamp(), 'y': 0},
+        ]])
+
+    def test_month(self):
+        class MonthChart(SignupChart):
+            bucket = MONTH
+            time_range = None
+
+        # Data's range is used
+        series = self.series(MonthChart(request=None))
+        self.assertEqual(series, [[
+            {'x': utc(2019, 12, 1).timestamp(), 'y': 1},
+            {'x': utc(2020, 1, 1).timestamp(), 'y': 3},
+        ]])
+
+    def test_not_declared(self):
+        chart = TimeSeriesChart(request=None)
+        self.assertEqual(chart.series, [])
+        with self.assertRaises(ImproperlyConfigured):
+            chart.values
+
+    def test_hand_written(self):
+        class JoinedChart(TimeSeriesChart):
+            model = User
+
+            def series(self):
+                return [[{'x': x.date_joined.timestamp(), 'y': 1}
+                         for x in self.values]]
+
+        series = JoinedChart(request=None).series
+        self.assertEqual(sorted(x['x'] for x in series[0]), [
+            utc(2019, 12, 1).timestamp(),
+            utc(2020, 1, 1, 20).timestamp(),
+            utc(2020, 1, 3, 1).timestamp(),
+            utc(2020, 1, 3, 12).timestamp(),
+        ])
+
+
+class PivotTest(TestCase):
+    def setUp(self):
+        rows = [('a', False), ('a', True), ('a', True), ('b', False),
+                ('c', True)]
+        for i, (last_name, is_staff) in enumerate(rows):
+            User.objects.create(username='user{}'.format(i),
+                                last_name=last_name, is_staff=is_staff)
+
+    def test_pivot(self):
+        class StaffChart(BarChart):
+            model = User
+            x_field = 'last_name'
+            split_field = 'is_staff'
+
+        chart = StaffChart(request=None)
+        with self.assertNumQueries(1):
+            self.assertEqual(chart.labels, ['a', 'b', 'c'])
+            # Missing values are filled
+            self.assertEqual(chart.series, [[1, 1, 0], [2, 0, 1]])
+            self.assertEqual(chart.legend, [False, True])
+
+    def test_no_split(self):
+        class UserChart(LineChart):
+            model = User
+            x_field = 'last_name'
+
+        # Line chart reverses data, so it's fetched backwards
+        chart = UserChart(request=None)
+        self.assertEqual(chart.labels, ['c', 'b', 'a'])
+        self.assertEqual(chart.series, [[1, 1, 3]])
+        self.assertEqual(chart.legend, [])
+
+    def test_not_declared(self):
+        class UserChart(BarChart):
+            model = User
+            limit_to = 2
+
+            def series(self):
+                return [[len(self.values)]]
+
+        # Regular queryset is used
+        self.assertEqual(UserChart(request=None).series, [[2]])
+        self.assertEqual(UserChart(request=None).labels, [])
+
+
+class DownsampleTest(TestCase):
+    def test_line(self):
+        class BigChart(LineChart):
+            max_points = 20
+
+            def labels(self):
+                return list(range(1000))
+
+            def series(self):
+                return [list(range(1000)), [x % 10 for x in range(1000)]]
+
+        chart = BigChart(request=None)
+        data = chart.chart_data
+        # Series split the points
+        self.assertGreaterEqual(len(data['labels']), 10)
+        self.assertLessEqual(len(data['labels']), 20)
+        self.assertEqual(len(data['labels']), len(data['series'][0]))
+        self.assertEqual(len(data['labels']), len(data['series'][1]))
+        # Labels are kept in sync
+        self.assertEqual(data['labels'], data['series'][0])
+        self.assertEqual(chart.get_json_data()['labels'], data['labels'])
+        # Raw data is still available
+        self.assertEqual(len(chart.series[0]), 1000)
+
+        # Many series never exceed the limit
+        class ManyChart(BigChart):
+            max_points = 100
+
+            def series(self):
+                return [[random.random() for x in range(1000)]
+                        for i in range(5)]
+
+        data = ManyChart(request=None).chart_data
+        self.assertLessEqual(len(data['labels']), 100)
+        self.assertEqual([len(x) for x in data['series']],
+                         [len(data['labels'])] * 5)
+
+        # Even a tiny one
+        BigChart.max_points = 4
+        data = BigChart(request=None).chart_data
+        self.assertEqual(data['labels'], [0, 999])
+
+    def test_time_series(self):
+        class BigChart(TimeSeriesChart):
+            max_points = 10
+
+            def series(self):
+                return [[{'x': x, 'y': x % 7} for x in range(100)]]
+
+        series = BigChart(request=None).chart_data['series']
+        self.assertEqual(len(series[0]), 10)
+        self.assertEqual(series[0][0], {'x': 0, 'y': 0})
+
+    def test_bar(self):
+        class BigChart(SingleBarChart):
+            max_points = 10
+
+            def labels(self):
+                return list(range(100))
+
+            def series(self):
+                return [x % 13 for x in range(100)]
+
+        data = BigChart(request=None).chart_data
+        self.assertLessEqual(len(data['series']), 10)
+        # Labels are the ones of the values left
+        self.assertEqual(data['series'], [x % 13 for x in data['labels']])
+
+    def test_pie(self):
+        class BigChart(PieChart):
+            max_points = 10
+
+            def series(self):
+                return [list(range(100))]
+
+        # Pies are not downsampled
+        data = BigChart(request=None).chart_data
+        self.assertEqual(len(data['series'][0]), 100)
+
+
+class EncodingTest(TestCase):
+    def test_default(self):
+        class PointsChart(TimeSeriesChart):
+            def series(self):
+                return [[{'x': 1.0, 'y': 0.123456}]]
+
+        # Sent as it is
+        chart = PointsChart(request=None)
+        self.assertEqual(chart.chart_data['series'],
+                         [[{'x': 1.0, 'y': 0.123456}]])
+
+    def test_columnar(self):
+        class PointsChart(TimeSeriesChart):
+            columnar = True
+            float_precision = 2
+
+            def series(self):
+                return [
+                    [{'x': 86400.0 * x, 'y': x / 3.0} for x in range(1, 4)],
+                    [{'x': 0, 'y': Decimal('1.50')}],
+                ]
+
+        chart = PointsChart(request=None)
+        self.assertEqual(chart.chart_data['series'], [
+            {'x': [86400, 172800, 259200], 'y': [0.33, 0.67, 1]},
+            {'x': [0], 'y': [1.5]},
+        ])
+        self.assertEqual(chart.get_json_data()['series'],
+                         chart.chart_data['series'])
+
+        PointsChart.delta_x = True
+        chart = PointsChart(request=None)
+        self.assertEqual(chart.chart_data['series'][0], {
+            'x': [86400, 86400, 86400],
+            'y': [0.33, 0.67, 1],
+            'delta': True,
+        })
+
+    def test_precision(self):
+        class ThirdsChart(LineChart):
+            float_precision = 1
+
+            def series(self):
+                return [[1 / 3.0, 2 / 3.0, None]]
+
+        chart = ThirdsChart(request=None)
+        self.assertEqual(chart.chart_data['series'], [[0.3, 0.7, None]])
+
+
+class IncrementalTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        User.objects.create(username='user0', date_joined=utc(2020, 1, 1))
+        User.objects.create(username='user1', date_joined=utc(2020, 1, 4))
+
+    def series(self, now):
+        chart = ClosedSignupChart(request=None)
+        with mock.patch('django.utils.timezone.now', return_value=now):
+            return [x['y'] for x in chart.series[0]]
+
+    def test_closed_buckets(self):
+        now = utc(2020, 1, 4, 10)
+        self.assertEqual(self.series(now), [1, 0, 0, 1])
+
+        # Closed buckets are not computed again
+        User.objects.create(username='user2', date_joined=utc(2020, 1, 2))
+        User.objects.create(username='user3', date_joined=utc(2020, 1, 4, 5))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.series(now), [1, 0, 0, 2])
+        self.assertEqual(len(queries), 1)
+        self.assertIn('2020-01-04', queries[0]['sql'])
+
+        # Next day the bucket is closed and the first one is out
+        User.objects.create(username='user4', date_joined=utc(2020, 1, 5))
+        self.assertEqual(self.series(utc(2020, 1, 5, 1)), [0, 0, 2, 1])
+
+        # New generation, new buckets
+        ClosedSignupChart.invalidate_cache()
+        self.assertEqual(self.series(utc(2020, 1, 5, 1)), [1, 0, 2, 1])
+
+    def test_closed_buckets_tz(self):
+        now = utc(2020, 1, 4, 10)
+        self.assertEqual(self.series(now), [1, 0, 0, 1])
+
+        # Buckets of another zone are not mixed in
+        with timezone.override('America/New_York'):
+            self.assertEqual(self.series(now), [0, 0, 1, 0])
+
+    def test_delta(self):
+        chart = ClosedSignupChart(request=None)
+        with mock.patch('django.utils.timezone.now',
+                        return_value=utc(2020, 1, 4, 10)), \
+                CaptureQueriesContext(connection) as queries:
+            delta = chart.get_json_delta(utc(2020, 1, 3).timestamp())
+        # Older buckets are not queried
+        self.assertEqual(len(queries), 1)
+        self.assertIn('2020-01-03', queries[0]['sql'])
+        self.assertEqual(delta['series'], [[
+            {'x': utc(2020, 1, 3).timestamp(), 'y': 0},
+            {'x': utc(2020, 1, 4).timestamp(), 'y': 1},
+        ]])
+        self.assertEqual(delta['since'], utc(2020, 1, 3).timestamp())
+        self.assertEqual(delta['start'], utc(2020, 1, 1).timestamp())
+
+    @override_settings(CONTROLCENTER_DASHBOARDS=[
+        ('foo', 'tests.test_widgets_charts.SignupDashboard')])
+    def test_view(self):
+        User.objects.create_superuser(
+            'superuser', 'superuser@example.com', 'superpassword')
+        self.client.login(username='superuser', password='superpassword')
+        url = '/admin/dashboard/foo/widget/closedsignupchart/data/'
+
+        # Full data without a valid timestamp
+        data = self.client.get(url, {'since': 'foo'}).json()
+        self.assertNotIn('since', data)
+        self.assertEqual(len(data['series'][0]), 4)
+
+        since = data['series'][0][-1]['x']
+        data = self.client.get(url, {'since': since}).json()
+        self.assertEqual(data['since'], since)
+        self.assertEqual(len(data['series'][0]), 1)
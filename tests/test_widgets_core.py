@@ -1,11 +1,25 @@
 import itertools
+from datetime import datetime, timedelta, timezone
+from unittest import mock
 
-from django.contrib.auth.models import User
+from django.contrib.auth.models import Permission, User
+from django.core.cache import cache
 from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
 from django.db.models.query import QuerySet
-
-from controlcenter import widgets
-from controlcenter.widgets.core import BaseWidget, WidgetMeta
+from django.template.loader import render_to_string
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import translation
+
+from controlcenter import Dashboard, widgets
+from controlcenter.widgets.contrib import simple
+from controlcenter.widgets.core import (
+    BaseWidget,
+    WidgetMeta,
+    decode_cursor,
+    encode_cursor,
+)
 
 from . import TestCase
 
@@ -91,6 +105,198 @@ class BaseWidgetTest(TestCase):
         self.assertEqual(len(self.widget1.values), User.objects.count())
 
 
+class DataCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.counter = counter = itertools.count()
+
+        class CachedWidget(BaseWidget):
+            data_cache_timeout = 60
+
+            def values(self):
+                return next(counter)
+
+        class CachedChildWidget(CachedWidget):
+            def values(self):
+                return super(CachedChildWidget, self).values + 100
+
+        self.widget_class = CachedWidget
+        self.child_class = CachedChildWidget
+
+    def test_no_cache(self):
+        widget = self.widget_class(request=None)
+        widget.data_cache_timeout = None
+        self.assertEqual(widget.values, 0)
+        self.assertEqual(self.widget_class(request=None).values, 1)
+        value, computed_at = cache.get(widget.get_data_cache_key('values'))
+        self.assertEqual(value, 1)
+
+    def test_cache(self):
+        # Evaluated once
+        for i in range(3):
+            self.assertEqual(self.widget_class(request=None).values, 0)
+
+        # Options are a part of the key
+        self.assertEqual(self.widget_class(None, foo=1).values, 1)
+
+        # Language too
+        with translation.override('de'):
+            self.assertEqual(self.widget_class(request=None).values, 2)
+        self.assertEqual(self.widget_class(None, foo=1).values, 1)
+
+        # Invalidation
+        self.widget_class.invalidate_cache()
+        self.assertEqual(self.widget_class(request=None).values, 3)
+        self.assertEqual(self.widget_class(request=None).values, 3)
+
+        # Version
+        widget = self.widget_class(request=None)
+        widget.data_cache_version = 2
+        self.assertEqual(widget.values, 4)
+
+    def test_super(self):
+        # Parent's value is not cached under the same key
+        self.assertEqual(self.child_class(request=None).values, 100)
+        self.assertEqual(self.child_class(request=None).values, 100)
+        self.assertEqual(self.widget_class(request=None).values, 1)
+
+    def test_vary(self):
+        factory = RequestFactory()
+        self.widget_class.data_cache_vary = ('params',)
+        request = factory.get('/', {'foo': 'bar'})
+        self.assertEqual(self.widget_class(request).values, 0)
+        self.assertEqual(self.widget_class(request).values, 0)
+        self.assertEqual(self.widget_class(factory.get('/')).values, 1)
+
+    def test_refresh(self):
+        self.assertEqual(self.widget_class(request=None).values, 0)
+
+        widget = self.widget_class(request=None)
+        widget.refresh_cache = True
+        self.assertEqual(widget.values, 1)
+        self.assertEqual(self.widget_class(request=None).values, 1)
+
+    @mock.patch('time.time', return_value=1000)
+    def test_stale_while_revalidate(self, now):
+        self.widget_class.data_cache_timeout = 10
+        self.widget_class.data_cache_stale_timeout = 100
+        run_now = mock.patch('controlcenter.widgets.core.run_in_background',
+                             side_effect=lambda func, *args: func(*args))
+
+        # Fresh
+        self.assertEqual(self.widget_class(request=None).values, 0)
+        now.return_value = 1009
+        self.assertEqual(self.widget_class(request=None).values, 0)
+
+        # Stale value is returned, the new one is computed in background
+        now.return_value = 1010
+        with run_now as run:
+            self.assertEqual(self.widget_class(request=None).values, 0)
+            self.assertEqual(run.call_count, 1)
+        self.assertEqual(self.widget_class(request=None).values, 1)
+
+        # Somebody is computing it already
+        widget = self.widget_class(request=None)
+        cache.add(widget.get_data_cache_key('values') + ':lock', 1)
+        now.return_value = 1020
+        with run_now as run:
+            self.assertEqual(widget.values, 1)
+            self.assertFalse(run.called)
+
+        # Hard timeout
+        now.return_value = 1200
+        self.assertEqual(self.widget_class(request=None).values, 2)
+
+    @mock.patch('time.time', return_value=1000)
+    def test_stale_no_revalidate(self, now):
+        self.widget_class.data_cache_timeout = 10
+        self.assertEqual(self.widget_class(request=None).values, 0)
+
+        # Stale value is not served without the stale timeout
+        widget = self.widget_class(request=None)
+        cache.set(widget.get_data_cache_key('values'), (0, 900))
+        self.assertEqual(widget.values, 1)
+
+
+class CacheKeyTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.counter = counter = itertools.count()
+
+        class CounterList(simple.ValueList):
+            cache_timeout = 60
+
+            def get_data(self):
+                return ['counter_{}'.format(next(counter))]
+
+        self.widget_class = CounterList
+
+    def test_key(self):
+        key = self.widget_class(request=None).get_cache_key()
+        self.assertTrue(key.startswith('controlcenter:fragment:'))
+        self.assertEqual(self.widget_class(request=None).get_cache_key(),
+                         key)
+
+        # Options
+        self.assertNotEqual(
+            self.widget_class(request=None, foo=1).get_cache_key(), key)
+
+        # Dashboard
+        widget = self.widget_class(request=None)
+        widget.dashboard = Dashboard(pk='foo')
+        self.assertNotEqual(widget.get_cache_key(), key)
+
+        # Language
+        with translation.override('de'):
+            self.assertNotEqual(
+                self.widget_class(request=None).get_cache_key(), key)
+
+        # Same class name, different widget
+        class CounterList(self.widget_class):
+            pass
+
+        self.assertNotEqual(CounterList(request=None).get_cache_key(), key)
+
+        # Invalidation
+        self.widget_class.invalidate_cache()
+        self.assertNotEqual(
+            self.widget_class(request=None).get_cache_key(), key)
+
+    def test_vary_on_user(self):
+        factory = RequestFactory()
+        request0, request1 = factory.get('/'), factory.get('/')
+        request0.user, request1.user = User(pk=1), User(pk=2)
+        key = self.widget_class(request0).get_cache_key()
+        self.assertEqual(self.widget_class(request1).get_cache_key(), key)
+
+        self.widget_class.cache_vary = ('user',)
+        self.assertNotEqual(self.widget_class(request0).get_cache_key(),
+                            self.widget_class(request1).get_cache_key())
+
+    def test_prefix(self):
+        with self.settings(CONTROLCENTER_CACHE_KEY_PREFIX='foo'):
+            key = self.widget_class(request=None).get_cache_key()
+            self.assertTrue(key.startswith('foo:fragment:'))
+
+    def test_render(self):
+        def render(widget):
+            return render_to_string('controlcenter/widget.html',
+                                    {'widget': widget})
+
+        # Cached
+        html = render(self.widget_class(None))
+        self.assertIn('counter_', html)
+        self.assertEqual(render(self.widget_class(None)), html)
+
+        # Different options
+        self.assertNotEqual(render(self.widget_class(None, foo=1)), html)
+
+        # Cache is off
+        widget = self.widget_class(None)
+        widget.cache_timeout = None
+        self.assertNotEqual(render(widget), html)
+
+
 class ItemListTest(TestCase):
     # TODO: template test
 
@@ -102,6 +308,389 @@ class ItemListTest(TestCase):
         self.assertIsNotNone(self.widget.template_name)
         self.assertIsNotNone(self.widget.empty_message)
 
+    def test_columns(self):
+        class UserList(widgets.ItemList):
+            model = User
+            list_display = ['#', 'pk', 'username', 'bold', 'pk']
+            list_display_links = ['username']
+
+            def bold(self, obj):
+                return '<b>'
+
+            def values(self):
+                return [(1, 'a<'), {'pk': 2, 'username': 'b'},
+                        User(pk=3, username='c'), (4,)]
+
+        widget = UserList(request=None)
+        columns = widget.columns
+        self.assertIs(widget.columns, columns)
+        self.assertEqual([x.attrname for x in columns],
+                         ['#', 'pk', 'username', 'bold', 'pk'])
+        self.assertEqual([x.is_sharp for x in columns],
+                         [True, False, False, False, False])
+        self.assertEqual([x.is_link for x in columns],
+                         [False, False, True, False, False])
+        # Sharp is skipped, duplicates get the first one
+        self.assertEqual([x.index for x in columns], [None, 0, 1, 2, 0])
+        self.assertEqual(columns[1].label, 'ID')
+        self.assertEqual(columns[2].label, 'username')
+
+        values = [[value for column, value in row.cells]
+                  for row in widget.rows]
+        self.assertEqual(values, [
+            [None, '1', 'a&lt;', '&lt;b&gt;', '1'],
+            [None, '2', 'b', '&lt;b&gt;', '2'],
+            [None, '3', 'c', '&lt;b&gt;', '3'],
+            [None, '4', '', '&lt;b&gt;', '4'],
+        ])
+
+        # The first column is a link by default
+        widget.list_display_links = None
+        self.assertEqual([x.is_link for x in widget.get_columns()],
+                         [True, False, False, False, False])
+
+    def test_render(self):
+        class UserList(widgets.ItemList):
+            model = User
+            list_display = ['#', 'username']
+
+            def values(self):
+                return [('<a>',), ('b',)]
+
+        widget = UserList(request=None)
+        html = render_to_string('controlcenter/widgets/itemlist.html',
+                                {'widget': widget, 'sharp': '#'})
+        self.assertInHTML(
+            '<th class="controlcenter__table__th '
+            'controlcenter__table__th--username">Username</th>', html)
+        self.assertInHTML(
+            '<td class="controlcenter__table__td '
+            'controlcenter__table__td--username">&lt;a&gt;</td>', html)
+        self.assertInHTML(
+            '<td class="controlcenter__table__td '
+            'controlcenter__table__td--row-counter">2</td>', html)
+
+
+class UserPages(widgets.ItemList):
+    model = User
+    list_display = ['username']
+    paginate_by = 3
+    paginate_ordering = ('is_active', '-pk')
+
+
+class PaginatedDashboard(Dashboard):
+    widgets = (UserPages,)
+
+
+class PaginationTest(TestCase):
+    def setUp(self):
+        for i in range(8):
+            User.objects.create_user('user{}'.format(i))
+        self.users = list(User.objects.order_by('-pk'))
+
+    def get_pages(self, klass):
+        pages, cursor = [], None
+        for index in range(len(self.users)):
+            widget = klass(request=None, cursor=cursor)
+            pages.append(list(widget.values))
+            cursor = widget.values.next_cursor
+            if cursor is None:
+                return pages
+        self.fail('Pages never end')
+
+    def test_cursor(self):
+        cursor = encode_cursor({'key': [True, 1]})
+        self.assertEqual(decode_cursor(cursor), {'key': [True, 1]})
+        when = datetime(2020, 1, 1, 12, 30, 15, 123456, tzinfo=timezone.utc)
+        self.assertEqual(decode_cursor(encode_cursor({'key': [when]})),
+                         {'key': ['2020-01-01T12:30:15.123456+00:00']})
+        self.assertIsNone(decode_cursor('foo'))
+        self.assertIsNone(decode_cursor(encode_cursor([1])))
+
+    def test_keyset(self):
+        pages = self.get_pages(UserPages)
+        self.assertEqual([len(x) for x in pages], [3, 3, 2])
+        self.assertEqual(sum(pages, []), self.users)
+
+        # Seeks instead of skipping rows
+        cursor = UserPages(request=None).values.next_cursor
+        self.assertEqual(decode_cursor(cursor),
+                         {'key': [True, self.users[2].pk]})
+        with CaptureQueriesContext(connection) as queries:
+            list(UserPages(request=None, cursor=cursor).values)
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('OFFSET', queries[0]['sql'])
+
+    def test_keyset_datetime(self):
+        class UserJoined(UserPages):
+            paginate_ordering = ('date_joined', 'pk')
+
+        # Users are made within the same millisecond
+        joined = datetime(2020, 1, 1, 12, tzinfo=timezone.utc)
+        for index, user in enumerate(self.users):
+            user.date_joined = joined.replace(microsecond=index)
+            user.save()
+
+        pages = self.get_pages(UserJoined)
+        self.assertEqual(sum(pages, []), self.users)
+
+    def test_nullable(self):
+        # Every other user has logged in
+        now = datetime(2020, 1, 1, 12, tzinfo=timezone.utc)
+        for index, user in enumerate(self.users[::2]):
+            user.last_login = now - timedelta(days=index % 2)
+            user.save()
+
+        # NULLs are the greatest
+        users = sorted(User.objects.all(), key=lambda x: (
+            x.last_login is None, x.last_login or now, x.pk))
+        for ordering, expected in ((('last_login', 'pk'), users),
+                                   (('-last_login', '-pk'), users[::-1])):
+            klass = type('UserLogins', (UserPages,),
+                         {'paginate_ordering': ordering})
+            pages = self.get_pages(klass)
+            self.assertEqual([len(x) for x in pages], [3, 3, 2])
+            self.assertEqual(sum(pages, []), expected)
+
+    def test_offset(self):
+        class UserValues(UserPages):
+            # Rows don't have the pk
+            queryset = User.objects.values_list('username')
+
+        pages = self.get_pages(UserValues)
+        self.assertEqual(sum(pages, []),
+                         [(x.username,) for x in self.users])
+        cursor = UserValues(request=None).values.next_cursor
+        self.assertEqual(decode_cursor(cursor), {'offset': 3})
+
+        class UserOffset(UserPages):
+            paginate_ordering = None
+            queryset = User.objects.order_by('-pk')
+
+        self.assertEqual(sum(self.get_pages(UserOffset), []), self.users)
+
+    def test_invalid_cursor(self):
+        for cursor in ('foo', encode_cursor({'key': [1]}),
+                       encode_cursor({'offset': -1}),
+                       # Values the fields can't take
+                       encode_cursor({'key': ['x', 'y']}),
+                       encode_cursor({'key': [True, 'y']}),
+                       encode_cursor({'key': [True, [1]]}),
+                       encode_cursor({'key': [True, 10 ** 30]})):
+            widget = UserPages(request=None, cursor=cursor)
+            self.assertEqual(list(widget.values), self.users[:3])
+
+    def test_not_paginated(self):
+        class UserList(widgets.ItemList):
+            queryset = User.objects.order_by('-pk')
+            limit_to = 2
+
+        self.assertEqual(list(UserList(request=None).values),
+                         self.users[:2])
+
+    @override_settings(CONTROLCENTER_DASHBOARDS=[
+        ('foo', 'tests.test_widgets_core.PaginatedDashboard')])
+    def test_view(self):
+        User.objects.create_superuser(
+            'superuser', 'superuser@example.com', 'superpassword')
+        self.client.login(username='superuser', password='superpassword')
+
+        response = self.client.get('/admin/dashboard/foo/')
+        self.assertContains(response, 'superuser')
+        self.assertNotContains(response, 'user5')
+        self.assertContains(response, 'data-page>Next')
+        self.assertNotContains(response, 'First')
+
+        # The next page is the fragment
+        cursor = encode_cursor({'key': [True, self.users[1].pk]})
+        url = '/admin/dashboard/foo/widget/userpages/?cursor=' + cursor
+        response = self.client.get(url)
+        self.assertContains(response, 'user5')
+        self.assertNotContains(response, 'superuser')
+        self.assertContains(response, 'href="/admin/dashboard/foo/widget/'
+                                      'userpages/" data-page>&laquo; First')
+        self.assertContains(response, 'data-page>Next')
+
+        # Tampered cursor is the first page
+        cursor = encode_cursor({'key': ['x', 'y']})
+        url = '/admin/dashboard/foo/widget/userpages/?cursor=' + cursor
+        response = self.client.get(url)
+        self.assertContains(response, 'superuser')
+
+
+class SortingTest(TestCase):
+    def setUp(self):
+        for name in ('b', 'c', 'a', 'd'):
+            User.objects.create_user(name, email=name + '@example.com')
+
+        class UserList(widgets.ItemList):
+            model = User
+            list_display = ['pk', 'username', 'email']
+            sort_fields = ['username', 'pk']
+            limit_to = 3
+
+        self.widget_class = UserList
+
+    def usernames(self, widget):
+        return [x.username for x in widget.values]
+
+    def test_sort(self):
+        self.assertIsNone(self.widget_class(request=None).get_sort())
+        self.assertEqual(
+            self.usernames(self.widget_class(request=None, o='username')),
+            ['a', 'b', 'c'])
+        self.assertEqual(
+            self.usernames(self.widget_class(request=None, o='-username')),
+            ['d', 'c', 'b'])
+
+        # Not whitelisted
+        widget = self.widget_class(request=None, o='email')
+        self.assertIsNone(widget.get_sort())
+        self.assertIsNone(widget.get_sort_ordering())
+
+        # Column maps to a field
+        self.widget_class.sort_fields = {'username': 'email'}
+        widget = self.widget_class(request=None, o='-username')
+        self.assertEqual(widget.get_sort_ordering(), ('-email', '-pk'))
+
+    def test_paginated(self):
+        self.widget_class.paginate_by = 3
+        widget = self.widget_class(request=None, o='-username')
+        self.assertEqual(self.usernames(widget), ['d', 'c', 'b'])
+
+        cursor = widget.values.next_cursor
+        self.assertEqual(decode_cursor(cursor)['key'][0], 'b')
+        widget = self.widget_class(request=None, o='-username',
+                                   cursor=cursor)
+        self.assertEqual(self.usernames(widget), ['a'])
+
+    def test_columns(self):
+        widget = self.widget_class(request=None, o='username')
+        widget.dashboard = Dashboard(pk='foo')
+        pk, username, email = widget.columns
+        url = '/admin/dashboard/foo/widget/userlist/'
+
+        self.assertEqual(username.sorted, 'asc')
+        self.assertEqual(username.sort_url, url + '?o=-username')
+        self.assertIsNone(pk.sorted)
+        self.assertEqual(pk.sort_url, url + '?o=pk')
+        self.assertIsNone(email.sort_url)
+
+        # Sort is kept while paging
+        self.assertEqual(widget.get_page_url('foo'),
+                         url + '?o=username&cursor=foo')
+
+    def test_cache_key(self):
+        widget0 = self.widget_class(request=None, o='username')
+        widget1 = self.widget_class(request=None, o='-username')
+        self.assertNotEqual(widget0.get_cache_key(), widget1.get_cache_key())
+        self.assertNotEqual(widget0.get_data_cache_key('values'),
+                            widget1.get_data_cache_key('values'))
+
+    def test_render(self):
+        html = render_to_string('controlcenter/widgets/itemlist.html',
+                                {'widget': self.widget_class(request=None),
+                                 'sharp': '#'})
+        # Client side sorting is off
+        self.assertNotIn('data-sortable', html)
+
+
+class QuerysetOptimizationTest(TestCase):
+    def setUp(self):
+        class PermissionList(widgets.ItemList):
+            model = Permission
+            list_display = ['#', 'name', 'content_type__app_label',
+                            'content_type', 'get_codename']
+            limit_to = None
+
+            def get_codename(self, obj):
+                return obj.codename
+
+        self.widget_class = PermissionList
+        self.count = Permission.objects.count()
+
+    def test_select_related(self):
+        widget = self.widget_class(request=None)
+        self.assertEqual(widget.get_select_related(Permission),
+                         ['content_type'])
+        with self.assertNumQueries(1):
+            rows = widget.rows
+        self.assertEqual(len(rows), self.count)
+
+        # Values contain everything
+        label = rows[0].cells[2][1]
+        self.assertEqual(label, rows[0].obj.content_type.app_label)
+        self.assertEqual(widget.columns[2].label, 'app label')
+
+        # Declared
+        self.widget_class.list_select_related = False
+        widget = self.widget_class(request=None)
+        self.assertFalse(widget.values.query.select_related)
+
+        self.widget_class.list_select_related = True
+        widget = self.widget_class(request=None)
+        self.assertTrue(widget.values.query.select_related)
+
+    def test_prefetch_related(self):
+        class UserList(widgets.ItemList):
+            model = User
+            list_display = ['username', 'groups']
+            list_prefetch_related = ['groups']
+
+        User.objects.create_user('user')
+        widget = UserList(request=None)
+        self.assertEqual(widget.get_select_related(User), [])
+        self.assertEqual(widget.values._prefetch_related_lookups,
+                         ('groups',))
+
+    def test_only(self):
+        widget = self.widget_class(request=None)
+        # Widget's method might need anything
+        self.assertIsNone(widget.get_only_fields(Permission))
+
+        self.widget_class.list_display = ['name', 'content_type__app_label']
+        self.widget_class.list_only = True
+        widget = self.widget_class(request=None)
+        self.assertEqual(
+            widget.get_only_fields(Permission),
+            ['content_type', 'content_type__app_label', 'name', 'pk'])
+        obj = widget.values[0]
+        self.assertEqual(obj.get_deferred_fields(), {'codename'})
+        self.assertEqual(obj.content_type.get_deferred_fields(), {'model'})
+
+        # Declared relations are loaded too
+        self.widget_class.list_display = ['name']
+        self.widget_class.list_select_related = ['content_type']
+        widget = self.widget_class(request=None)
+        self.assertEqual(widget.get_only_fields(Permission),
+                         ['content_type', 'name', 'pk'])
+        with self.assertNumQueries(1):
+            obj = widget.values[0]
+            self.assertTrue(obj.content_type.app_label)
+
+    def test_values(self):
+        class PermissionValues(self.widget_class):
+            queryset = Permission.objects.values('name')
+            list_display = ['name']
+            list_only = True
+
+        widget = PermissionValues(request=None)
+        self.assertFalse(widget.values.query.select_related)
+        self.assertEqual(widget.values.query.deferred_loading,
+                         (frozenset(), True))
+
+    def test_n_plus_one(self):
+        self.widget_class.list_select_related = False
+        with self.settings(DEBUG=True):
+            with self.assertLogs('controlcenter', 'WARNING') as logs:
+                self.widget_class(request=None).rows
+        self.assertIn('queries rendering', logs.output[0])
+
+        # Not in production
+        with mock.patch('controlcenter.widgets.core.logger') as logger:
+            self.widget_class(request=None).rows
+        logger.warning.assert_not_called()
+
 
 class GroupTest(TestCase):
     def setUp(self):